@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+#
+# Measures hc2000 cold start, i.e., the time it takes to run commands that
+# don't talk to AWS.
+#
+
+import argparse
+import os.path
+import subprocess
+import sys
+import time
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+_commands = [
+    ('python -c pass',          [ '-c', 'pass' ]),
+    ('hc2000 --help',           [ os.path.join(_root, 'hc2000'), '--help' ]),
+    ('hc2000 launch --help',    [ os.path.join(_root, 'hc2000'),
+                                    '--region', 'eu-west-1', 'launch',
+                                    '--help' ]),
+]
+
+def _run(args, runs):
+    timings = []
+    with open(os.devnull, 'wb') as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.check_call([ sys.executable ] + args, stdout=devnull)
+            timings.append(time.time() - start)
+    return timings
+
+parser = argparse.ArgumentParser(description='Measures hc2000 start up time.')
+parser.add_argument('-n', '--runs', type=int, default=20,
+        help='Number of runs per command.')
+config = parser.parse_args()
+
+for name, args in _commands:
+    timings = _run(args, config.runs)
+    print '%-24s  min %6.1fms  mean %6.1fms' % (name, min(timings) * 1000,
+            sum(timings) / len(timings) * 1000)
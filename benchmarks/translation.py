@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+#
+# Compares translating instance definitions with translator dicts, as
+# interpreted by hc2002.translation.translate, against compiled plans.
+#
+
+import argparse
+import os.path
+import sys
+import timeit
+
+sys.path.insert(0,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import hc2002.resource.instance as instance
+import hc2002.translation as xl
+
+_instance = {
+    'image':                'ami-12345678',
+    'instance-type':        'm1.large',
+    'count':                2,
+    'key':                  'deploy',
+    'role':                 'web',
+    'security-groups':      [ 'sg-12345678', 'web', 'ssh' ],
+    'subnet':               'subnet-12345678',
+    'availability-zone':    'eu-west-1a',
+    'user-data':            '#!/bin/sh\n',
+    'monitoring':           True,
+    'api-termination':      False,
+    'block-devices': {
+        '/dev/sdb':         { 'source': 'ephemeral0' },
+        '/dev/sdc':         { 'source': 'snap-12345678', 'size': 100,
+                                'iops': 1000 },
+        '/dev/sdd':         { 'source': 'no-device' },
+    },
+}
+
+_translators = [
+    ('launch instance', instance._launch_instance_mapping,
+        instance._launch_instance_plan),
+    ('block device', instance._block_device_mapping,
+        instance._block_device_plan),
+]
+
+parser = argparse.ArgumentParser(
+        description='Measures hc2002.translation throughput.')
+parser.add_argument('-n', '--number', type=int, default=10000,
+        help='Number of translations per measurement.')
+config = parser.parse_args()
+
+for name, mapping, plan in _translators:
+    source = _instance
+    if mapping is instance._block_device_mapping:
+        source = _instance['block-devices']['/dev/sdc']
+
+    for kind, translator in [ ('dict', mapping), ('plan', plan) ]:
+        timing = min(timeit.repeat(
+                lambda: xl.translate(translator, source),
+                number=config.number, repeat=3))
+        print '%-16s %-4s  %6.2fus' % (name, kind,
+                timing / config.number * 1e6)
@@ -0,0 +1,29 @@
+import threading
+import hc2002.config as config
+import hc2002.instrumentation as instrumentation
+
+# Connections are kept per thread, boto connection objects are not safe to
+# share across threads. Each connection keeps its own pool of keep-alive HTTP
+# connections, which get reused for as long as the thread lives.
+_local = threading.local()
+
+def get_connection(service, connect, region=None):
+    """Returns a connection to an AWS service, creating one if needed.
+
+    Connections are cached by service, region and credentials, so
+    multi-region operations don't step on each other. connect is called as
+    connect(region, aws_access_key_id=..., aws_secret_access_key=...). Service
+    modules import boto in connect, keeping it out of the start up path.
+    """
+    if region is None: region = config.region
+
+    if not hasattr(_local, 'connections'):
+        _local.connections = {}
+
+    key = (service, region, config.aws_access_key, config.aws_secret_key)
+    if key not in _local.connections:
+        _local.connections[key] = instrumentation.instrument_connection(
+                connect(region,
+                    aws_access_key_id=config.aws_access_key,
+                    aws_secret_access_key=config.aws_secret_key))
+    return _local.connections[key]
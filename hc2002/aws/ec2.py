@@ -1,12 +1,8 @@
-import boto.ec2
-import hc2002.config as config
+import hc2002.aws
 
-connection = None
+def _connect(region, **kwargs):
+    import boto.ec2
+    return boto.ec2.connect_to_region(region, **kwargs)
 
-def get_connection():
-    global connection
-    if connection is None:
-        connection = boto.ec2.connect_to_region(config.region,
-                aws_access_key_id=config.aws_access_key,
-                aws_secret_access_key=config.aws_secret_key)
-    return connection
+def get_connection(region=None):
+    return hc2002.aws.get_connection('ec2', _connect, region)
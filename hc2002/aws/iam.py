@@ -1,12 +1,8 @@
-import boto.iam
-import hc2002.config as config
+import hc2002.aws
 
-connection = None
+def _connect(region, **kwargs):
+    import boto.iam
+    return boto.iam.connect_to_region(region, **kwargs)
 
 def get_connection():
-    global connection
-    if connection is None:
-        connection = boto.iam.connect_to_region('universal',
-                aws_access_key_id=config.aws_access_key,
-                aws_secret_access_key=config.aws_secret_key)
-    return connection
+    return hc2002.aws.get_connection('iam', _connect, 'universal')
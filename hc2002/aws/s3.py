@@ -1,11 +1,8 @@
-import boto
-import hc2002.config as config
+import hc2002.aws
 
-connection = None
+def _connect(region, **kwargs):
+    import boto
+    return boto.connect_s3(**kwargs)
 
 def get_connection():
-    global connection
-    if connection is None:
-        connection = boto.connect_s3(aws_access_key_id=config.aws_access_key,
-                aws_secret_access_key=config.aws_secret_key)
-    return connection
+    return hc2002.aws.get_connection('s3', _connect, 'universal')
@@ -0,0 +1,68 @@
+import cPickle as pickle
+import hashlib
+import json
+import logging
+import os
+import os.path
+import shutil
+import tempfile
+import time
+
+import hc2002.config as config
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+def _filename(namespace, key):
+    key = json.dumps(key, sort_keys=True, default=repr)
+    return os.path.join(config.cache_path, namespace,
+            hashlib.sha1(key).hexdigest())
+
+def get(namespace, key, ttl=None, default=None):
+    """Returns the value cached under key, or default if there's no such
+    value or it is older than ttl seconds.
+
+    key may be any combination of dicts, lists and scalars, dicts are
+    normalized so key order doesn't matter.
+    """
+    if not config.use_cache:
+        return default
+
+    filename = _filename(namespace, key)
+    try:
+        with open(filename, 'rb') as f:
+            timestamp, value = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return default
+
+    if ttl is not None and time.time() - timestamp > ttl:
+        logger.debug('Cache entry expired: %s', filename)
+        return default
+    return value
+
+def put(namespace, key, value):
+    if not config.use_cache:
+        return
+
+    filename = _filename(namespace, key)
+    directory = os.path.dirname(filename)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+
+        # Write and rename, so concurrent readers never see partial entries
+        fd, temporary = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((time.time(), value), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary, filename)
+    except (IOError, OSError) as err:
+        logger.warning('Unable to write cache entry %s: %s', filename, err)
+
+def invalidate(namespace=None):
+    """Drops all entries in namespace, or the whole cache if no namespace is
+    given."""
+    path = config.cache_path
+    if namespace is not None:
+        path = os.path.join(path, namespace)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
@@ -8,3 +8,27 @@ aws_secret_key = os.environ.get('AWS_SECRET_KEY')
 handler_path = os.path.join(os.path.dirname(__file__), 'handler')
 
 puppet_path = []
+
+# Maximum number of concurrent workers when launching several instance
+# definitions. Each definition runs its own lookups, e.g., searches and blob
+# downloads, on up to lookup_jobs further workers.
+jobs = 4
+lookup_jobs = 4
+
+# Local cache of AWS lookups, e.g., search plugin results
+use_cache = True
+cache_path = os.path.join(os.environ.get('XDG_CACHE_HOME')
+        or os.path.expanduser(os.path.join('~', '.cache')), 'hc2000')
+cache_ttl = 3600
+
+# Local index of images and snapshots, see hc2000 index refresh. The index is
+# kept out of cache_path, as it isn't rebuilt on demand. Searches answered
+# from an index older than index_max_age seconds are logged as warnings.
+use_index = True
+index_path = os.path.join(os.environ.get('XDG_DATA_HOME')
+        or os.path.expanduser(os.path.join('~', '.local', 'share')),
+        'hc2000', 'index.sqlite')
+index_max_age = 86400
+
+# EC2 limit on the size of user-data, after compression
+user_data_limit = 16384
@@ -1,14 +1,27 @@
+import boto.exception
 import boto.s3.connection
 import boto.s3.bucket
 import boto.s3.key
 import grp
+import hashlib
+import httplib
+import multiprocessing.pool
 import os
 import os.path
 import pwd
 import re
+import socket
+import threading
+import time
 import urllib2
 import yaml
 
+# Files are fetched on up to _workers threads, in ranges of _range_size bytes.
+# Failed ranges are retried.
+_workers = 8
+_range_size = 16 << 20
+_retries = 3
+
 def _mode_x_from_r(mode):
     return mode | (mode & 0444) >> 2
 
@@ -29,54 +42,156 @@ def _get_url(url):
     response = urllib2.urlopen(url)
     return response.read()
 
+def _get_credentials(data):
+    with data.lock:
+        if data.credentials is None:
+            md_url = 'http://169.254.169.254/latest/meta-data/iam/security-credentials'
+
+            role = _get_url(md_url)
+            data.credentials = yaml.safe_load(_get_url(md_url + '/' + role))
+        return data.credentials
+
 def _get_key(data, source):
     bucket, _, key = source[len('s3://'):].partition('/')
-    if data.s3 is None:
-        md_url = 'http://169.254.169.254/latest/meta-data/iam/security-credentials'
-
-        role = _get_url(md_url)
-        creds = yaml.safe_load(_get_url(md_url + '/' + role))
 
-        data.s3 = boto.s3.connection.S3Connection(
+    # Connections aren't thread-safe, each fetching thread gets its own
+    local = data.local
+    if getattr(local, 's3', None) is None:
+        creds = _get_credentials(data)
+        local.s3 = boto.s3.connection.S3Connection(
                 aws_access_key_id=creds['AccessKeyId'],
                 aws_secret_access_key=creds['SecretAccessKey'],
                 security_token=creds['Token'])
+        local.buckets = {}
 
-    if bucket not in data.buckets:
-        data.buckets[bucket] = boto.s3.bucket.Bucket(data.s3, bucket)
-    return boto.s3.key.Key(data.buckets[bucket], key)
+    if bucket not in local.buckets:
+        local.buckets[bucket] = boto.s3.bucket.Bucket(local.s3, bucket)
+    return boto.s3.key.Key(local.buckets[bucket], key)
 
-def _fetch_file(data, source, file):
-    if source.startswith('s3://'):
-        key = _get_key(data, source)
-        key.get_contents_to_file(file)
-    else:
-        raise NotImplementedError
+def _md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
 
-def _mk_file(data, path, source, content, target):
+def _matches(path, size, md5):
+    if os.path.islink(path) or not os.path.isfile(path):
+        return False
+    return os.path.getsize(path) == size and _md5(path) == md5
+
+def _count(data, fetched, size=0):
+    with data.lock:
+        if fetched:
+            data.fetched += 1
+            data.bytes += size
+        else:
+            data.skipped += 1
+
+def _symlink(target, path):
+    # Replaces whatever is at path, e.g., from an earlier run, atomically
+    temporary = '%s.hc2000-%i' % (path, os.getpid())
+    if os.path.lexists(temporary):
+        os.unlink(temporary)
+    os.symlink(target, temporary)
+    os.rename(temporary, path)
+
+def _mk_file(data, path, source, content, target, fetches):
     parts = path.split('/')
     _mk_parents(data, parts[:-1])
     if not parts[-1]:
         return
     if target is not None:
-        os.symlink(target, path)
-    else:
-        with open(path, 'w+b') as file:
-            if content is not None:
+        if not os.path.islink(path) or os.readlink(path) != target:
+            _symlink(target, path)
+        data.created.append(path)
+        return
+
+    # Files replace symlinks left by earlier runs, rather than write through
+    if os.path.islink(path):
+        os.unlink(path)
+    if content is not None:
+        unchanged = _matches(path, len(content),
+                hashlib.md5(content).hexdigest())
+        if not unchanged:
+            with open(path, 'w+b') as file:
                 file.write(content)
-            else:
-                _fetch_file(data, source, file)
+        _count(data, not unchanged)
+    else:
+        fetches.append((path, source))
     data.created.append(path)
 
+def _get_range(data, source, path, start):
+    # Ranges are written in place, through their own file object. Empty
+    # objects have no satisfiable range.
+    for attempt in range(_retries, 0, -1):
+        try:
+            with open(path, 'r+b') as file:
+                file.seek(start)
+                key = _get_key(data, source)
+                key.get_contents_to_file(file, headers={ 'Range':
+                        'bytes=%i-%i' % (start, start + _range_size - 1) })
+            return key.size
+        except boto.exception.S3ResponseError as err:
+            if err.status == 416: return 0
+            if err.status < 500 or attempt == 1: raise
+        except (socket.error, httplib.HTTPException) as err:
+            if attempt == 1: raise
+        print 'hc2000 manifest: retrying %s: %s' % (source, err)
+
+def _fetch(data, ranges, path, source):
+    if not source.startswith('s3://'):
+        raise NotImplementedError
+
+    # Files already matching their source are left alone. ETags of multipart
+    # uploads aren't MD5 digests of the content.
+    if os.path.isfile(path):
+        key = _get_key(data, source)
+        key = key.bucket.get_key(key.name)
+        if key is None:
+            raise IOError('No such S3 object: %s' % source)
+        if _matches(path, key.size, key.etag.strip('"')):
+            _count(data, False)
+            return
+
+    # The first range tells the size of the object, and so its other ranges
+    open(path, 'wb').close()
+    size = _get_range(data, source, path, 0)
+    ranges.extend((source, path, start)
+            for start in range(_range_size, size, _range_size))
+    _count(data, True, size)
+
+def _fetch_all(data, fetches):
+    # Other ranges of large files are fetched on the same threads, once first
+    # ranges are, so at most _workers requests run at once
+    pool = multiprocessing.pool.ThreadPool(_workers)
+    ranges = []
+    start = time.time()
+    pool.map(lambda fetch: _fetch(data, ranges, *fetch), fetches)
+    pool.map(lambda range: _get_range(data, *range), ranges)
+    pool.close()
+
+    elapsed = max(time.time() - start, 1e-6)
+    print 'hc2000 manifest: fetched %i bytes in %.1fs, %.1f MB/s' \
+            % (data.bytes, elapsed, data.bytes / elapsed / (1 << 20))
+
 def _create(data):
+    # Directories are created in order, files are fetched concurrently
+    fetches = []
     for path, attr in sorted(data.files.iteritems()):
-        _mk_file(data, path, attr['source'], attr['content'], attr['target'])
+        _mk_file(data, path, attr['source'], attr['content'], attr['target'],
+                fetches)
+    _fetch_all(data, fetches)
+
     for path in reversed(data.created):
         attr = data.files[path]
         if not attr.get('target', None):
             os.chmod(path, attr['mode'])
         os.lchown(path, attr['uid'], attr['gid'])
 
+    print 'hc2000 manifest: %i files written, %i unchanged' \
+            % (data.fetched, data.skipped)
+
 def _uid(user):
     try: return pwd.getpwnam(user).pw_uid
     except: return -1
@@ -146,9 +261,13 @@ class _HC2000:
     def __init__(self):
         self.files = {}
         self.created = []
+        self.fetched = 0
+        self.skipped = 0
+        self.bytes = 0
 
-        self.s3 = None
-        self.buckets = {}
+        self.lock = threading.Lock()
+        self.credentials = None
+        self.local = threading.local()
 
 def list_types():
     return [ 'text/hc2000-manifest' ]
@@ -0,0 +1,279 @@
+import contextlib
+import json
+import logging
+import os
+import os.path
+import re
+import sqlite3
+import time
+
+import hc2002.aws.ec2
+import hc2002.config as config
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Items are indexed per region and scope. The scope is the owner used when
+# fetching items, e.g., 'self', 'amazon' or an account id.
+_schema = '''
+CREATE TABLE IF NOT EXISTS images (
+    region              TEXT NOT NULL,
+    scope               TEXT NOT NULL,
+    id                  TEXT NOT NULL,
+    name                TEXT,
+    description         TEXT,
+    owner_id            TEXT,
+    owner_alias         TEXT,
+    architecture        TEXT,
+    root_device_type    TEXT,
+    virtualization_type TEXT,
+    state               TEXT,
+    creation_date       TEXT,
+    tags                TEXT,
+    PRIMARY KEY (region, scope, id)
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    region              TEXT NOT NULL,
+    scope               TEXT NOT NULL,
+    id                  TEXT NOT NULL,
+    description         TEXT,
+    owner_id            TEXT,
+    owner_alias         TEXT,
+    volume_id           TEXT,
+    volume_size         TEXT,
+    status              TEXT,
+    start_time          TEXT,
+    tags                TEXT,
+    PRIMARY KEY (region, scope, id)
+);
+CREATE TABLE IF NOT EXISTS syncs (
+    region              TEXT NOT NULL,
+    kind                TEXT NOT NULL,
+    scope               TEXT NOT NULL,
+    synced_at           REAL NOT NULL,
+    PRIMARY KEY (region, kind, scope)
+);
+'''
+
+# Per kind: the owner parameter, as passed to boto, columns and the attribute
+# they are read from, and supported Describe* filters with matching columns.
+_kinds = {
+    'images': {
+        'owner':    'owners',
+        'columns':  [
+            ('id',                  'id'),
+            ('name',                'name'),
+            ('description',         'description'),
+            ('owner_id',            'ownerId'),
+            ('owner_alias',         'owner_alias'),
+            ('architecture',        'architecture'),
+            ('root_device_type',    'root_device_type'),
+            ('virtualization_type', 'virtualization_type'),
+            ('state',               'state'),
+            ('creation_date',       'creationDate'),
+        ],
+        'filters':  {
+            'image-id':             'id',
+            'name':                 'name',
+            'description':          'description',
+            'owner-id':             'owner_id',
+            'owner-alias':          'owner_alias',
+            'architecture':         'architecture',
+            'root-device-type':     'root_device_type',
+            'virtualization-type':  'virtualization_type',
+            'state':                'state',
+        },
+    },
+    'snapshots': {
+        'owner':    'owner',
+        'columns':  [
+            ('id',                  'id'),
+            ('description',         'description'),
+            ('owner_id',            'owner_id'),
+            ('owner_alias',         'owner_alias'),
+            ('volume_id',           'volume_id'),
+            ('volume_size',         'volume_size'),
+            ('status',              'status'),
+            ('start_time',          'start_time'),
+        ],
+        'filters':  {
+            'snapshot-id':          'id',
+            'description':          'description',
+            'owner-id':             'owner_id',
+            'owner-alias':          'owner_alias',
+            'volume-id':            'volume_id',
+            'volume-size':          'volume_size',
+            'status':               'status',
+        },
+    },
+}
+
+_patterns = {}
+
+def _wildcard(pattern):
+    # Describe* filters support '*' and '?' wildcards
+    if pattern not in _patterns:
+        _patterns[pattern] = re.compile('^%s$' % '.*'.join('.'.join(
+                re.escape(p) for p in part.split('?'))
+                    for part in pattern.split('*')), re.DOTALL)
+    return _patterns[pattern]
+
+def _match(pattern, value):
+    if value is None:
+        return False
+    return _wildcard(pattern).match(value) is not None
+
+def _tag(tags, key):
+    return json.loads(tags).get(key)
+
+@contextlib.contextmanager
+def _connect():
+    directory = os.path.dirname(config.index_path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0700)
+
+    db = sqlite3.connect(config.index_path)
+    try:
+        db.create_function('match', 2, _match)
+        db.create_function('tag', 2, _tag)
+        db.executescript(_schema)
+        with db:
+            yield db
+    finally:
+        db.close()
+
+class Item:
+    """Indexed image or snapshot. Columns are exposed as attributes, id, name
+    and description match those in boto objects."""
+    def __init__(self, row):
+        for k in row.keys():
+            setattr(self, k, row[k])
+        self.tags = json.loads(row['tags'])
+
+def _as_list(value):
+    if isinstance(value, (list, tuple)):
+        return value
+    return [ value ]
+
+def _where(kind, parameters):
+    """Translates Describe* parameters to an SQL condition, or returns None if
+    the index can't answer the query."""
+    spec = _kinds[kind]
+    if set(parameters) - set([ spec['owner'], 'filters' ]):
+        return None
+    if not parameters.get(spec['owner']):
+        return None
+
+    scopes = [ unicode(s) for s in _as_list(parameters[spec['owner']]) ]
+    conditions = [ 'region = ?',
+            'scope IN (%s)' % ','.join('?' * len(scopes)) ]
+    arguments = [ config.region ] + scopes
+
+    for name, values in sorted(parameters.get('filters', {}).iteritems()):
+        if name in spec['filters']:
+            column = spec['filters'][name]
+            alternatives = [ 'match(?, %s)' % column ]
+        elif name.startswith('tag:'):
+            alternatives = [ 'match(?, tag(tags, ?))' ]
+        else:
+            return None
+
+        values = _as_list(values)
+        conditions.append('(%s)' % ' OR '.join(alternatives * len(values)))
+        for v in values:
+            arguments.append(unicode(v))
+            if name.startswith('tag:'):
+                arguments.append(name[4:])
+
+    return scopes, ' AND '.join(conditions), arguments
+
+# Stale scopes already warned about, once per run is enough
+_stale = set()
+
+def _check_age(kind, scopes, synced_at):
+    age = time.time() - synced_at
+    key = (config.region, kind, tuple(scopes))
+    if age > config.index_max_age and key not in _stale:
+        _stale.add(key)
+        logger.warning('Indexed %s owned by %s were last synced %.1f days '
+                'ago, searches may miss newer items. Run hc2000 index '
+                'refresh, or use --no-index.', kind, ', '.join(scopes),
+                age / 86400)
+
+def search(kind, parameters):
+    """Looks up images or snapshots matching Describe* parameters in the
+    index. Returns None if the index can't answer the query, either because a
+    filter isn't supported, or the owner scope was never synced."""
+    if not config.use_index or not os.path.exists(config.index_path):
+        return None
+
+    where = _where(kind, parameters)
+    if where is None:
+        return None
+    scopes, condition, arguments = where
+
+    with _connect() as db:
+        db.row_factory = sqlite3.Row
+        synced, synced_at = db.execute('SELECT COUNT(*), MIN(synced_at) '
+                'FROM syncs WHERE region = ? AND kind = ? AND scope IN (%s)'
+                    % ','.join('?' * len(scopes)),
+                [ config.region, kind ] + scopes).fetchone()
+        if synced != len(scopes):
+            return None
+        _check_age(kind, scopes, synced_at)
+
+        rows = db.execute('SELECT * FROM %s WHERE %s' % (kind, condition),
+                arguments).fetchall()
+
+    logger.debug('Found %i indexed %s matching: %s', len(rows), kind,
+            parameters)
+    return [ Item(row) for row in rows ]
+
+def _row(kind, item):
+    values = []
+    for column, attribute in _kinds[kind]['columns']:
+        value = getattr(item, attribute, None)
+        values.append(None if value is None else unicode(value))
+    values.append(json.dumps(dict(getattr(item, 'tags', None) or {}),
+            sort_keys=True))
+    return tuple(values)
+
+def _fetch(kind, scope):
+    ec2 = hc2002.aws.ec2.get_connection()
+    if kind == 'images':
+        return ec2.get_all_images(owners=[ scope ])
+    return ec2.get_all_snapshots(owner=scope)
+
+def refresh(kind, scope):
+    """Syncs indexed images or snapshots for an owner scope. Only new or
+    changed items are written, and items that no longer exist are dropped.
+
+    Returns a tuple with the number of items written, removed, and the total
+    in the index.
+    """
+    items = _fetch(kind, scope)
+
+    columns = [ c for c, _ in _kinds[kind]['columns'] ] + [ 'tags' ]
+    with _connect() as db:
+        indexed = {}
+        for row in db.execute('SELECT %s FROM %s WHERE region = ? '
+                'AND scope = ?' % (','.join(columns), kind),
+                (config.region, scope)):
+            indexed[row[0]] = tuple(row)
+
+        written = []
+        for item in items:
+            row = _row(kind, item)
+            if indexed.pop(row[0], None) != row:
+                written.append((config.region, scope) + row)
+
+        db.executemany('INSERT OR REPLACE INTO %s (region, scope, %s) '
+                'VALUES (%s)' % (kind, ','.join(columns),
+                    ','.join('?' * (len(columns) + 2))), written)
+        db.executemany('DELETE FROM %s WHERE region = ? AND scope = ? '
+                'AND id = ?' % kind,
+                [ (config.region, scope, id) for id in indexed ])
+        db.execute('INSERT OR REPLACE INTO syncs VALUES (?, ?, ?, ?)',
+                (config.region, kind, scope, time.time()))
+
+    return len(written), len(indexed), len(items)
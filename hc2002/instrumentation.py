@@ -0,0 +1,124 @@
+import contextlib
+import json
+import threading
+import time
+
+import hc2002.parallel as parallel
+
+# Current recorder and stack of stage names, per thread. Stage stacks are
+# tuples, so worker threads can inherit them safely.
+_local = threading.local()
+parallel.inherit(_local, 'recorder', 'stages')
+
+class Recorder:
+    """Collects wall time, AWS calls and user-data growth per stage, e.g., per
+    plugin applied to an instance."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = []
+        self.stats = {}
+
+    def _get(self, name):
+        if name not in self.stats:
+            self.stages.append(name)
+            self.stats[name] = {
+                'seconds':          0.,
+                'aws-calls':        0,
+                'aws-seconds':      0.,
+                'aws-actions':      {},
+                'user-data-bytes':  0,
+            }
+        return self.stats[name]
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self._get(name)['seconds'] += seconds
+
+    def add_aws_call(self, name, action, seconds):
+        with self.lock:
+            stats = self._get(name)
+            stats['aws-calls'] += 1
+            stats['aws-seconds'] += seconds
+            stats['aws-actions'][action] = \
+                    stats['aws-actions'].get(action, 0) + 1
+
+    def add_user_data(self, name, size):
+        with self.lock:
+            self._get(name)['user-data-bytes'] += size
+
+    def as_dict(self):
+        with self.lock:
+            return [ dict(self.stats[name], stage=name)
+                    for name in self.stages ]
+
+    def report(self):
+        lines = [ '%-36s %9s %9s %9s %10s' % ('Stage', 'Time',
+                'AWS calls', 'AWS time', 'User-data') ]
+        for stats in self.as_dict():
+            lines.append('%-36s %8.3fs %9i %8.3fs %+10i' % (stats['stage'],
+                    stats['seconds'], stats['aws-calls'],
+                    stats['aws-seconds'], stats['user-data-bytes']))
+        return '\n'.join(lines)
+
+def current():
+    return getattr(_local, 'recorder', None)
+
+@contextlib.contextmanager
+def recording(recorder):
+    """Records stages entered by the current thread, and by worker threads it
+    starts, into recorder."""
+    previous = current(), getattr(_local, 'stages', ())
+    _local.recorder, _local.stages = recorder, ()
+    try:
+        yield recorder
+    finally:
+        _local.recorder, _local.stages = previous
+
+@contextlib.contextmanager
+def stage(name):
+    recorder = current()
+    if recorder is None:
+        yield
+        return
+
+    stages = _local.stages
+    _local.stages = stages + (name,)
+    start = time.time()
+    try:
+        yield
+    finally:
+        recorder.add_time(name, time.time() - start)
+        _local.stages = stages
+
+def add_user_data(size):
+    recorder = current()
+    if recorder is not None and _local.stages:
+        recorder.add_user_data(_local.stages[-1], size)
+
+def instrument_connection(connection):
+    """Wraps a boto connection, so requests it makes are accounted to the
+    innermost stage of the calling thread."""
+    make_request = connection.make_request
+
+    def _make_request(action, *args, **kwargs):
+        recorder = current()
+        if recorder is None:
+            return make_request(action, *args, **kwargs)
+
+        start = time.time()
+        try:
+            return make_request(action, *args, **kwargs)
+        finally:
+            name = _local.stages[-1] if _local.stages else '(none)'
+            recorder.add_aws_call(name, action, time.time() - start)
+
+    connection.make_request = _make_request
+    return connection
+
+def dump(recorders, filename):
+    """Exports recorders, a dictionary of name to recorder, as JSON."""
+    with open(filename, 'wb') as f:
+        json.dump(dict((name, recorder.as_dict())
+                for name, recorder in recorders.iteritems()), f,
+                indent=4, sort_keys=True)
@@ -0,0 +1,71 @@
+import yaml
+
+class MissingLock(Exception): pass
+
+# Attributes resolved by the search, vpc and symbolic_values plugins. Block
+# device sources are handled separately.
+_locked_keys = [
+    'availability-zone',
+    'image',
+    'kernel',
+    'key',
+    'load-balancers',
+    'ramdisk',
+    'security-groups',
+    'spot-price',
+    'subnet',
+]
+
+def load(filename):
+    """Loads a lockfile, mapping instance definition names to their resolved
+    attributes. A missing lockfile holds no definitions."""
+    try:
+        with open(filename) as f:
+            locks = yaml.safe_load(f)
+    except IOError:
+        return {}
+    return locks or {}
+
+def get(locks, name, filename):
+    """Returns the lock recorded for an instance definition, loaded from
+    filename."""
+    if name not in locks:
+        raise MissingLock('No lock for %s in %s' % (name, filename))
+    return locks[name]
+
+def save(filename, locks):
+    with open(filename, 'wb') as f:
+        f.write(yaml.safe_dump(locks, default_flow_style=False))
+
+def record(instance):
+    """Extracts resolved attributes from an instance, after plugins have been
+    applied to it."""
+    lock = {}
+    for key in _locked_keys:
+        if key in instance:
+            lock[key] = instance[key]
+
+    if 'block-devices' in instance:
+        sources = {}
+        for device, block_device in instance['block-devices'].iteritems():
+            if 'source' in block_device:
+                sources[device] = { 'source': block_device['source'] }
+        if sources:
+            lock['block-devices'] = sources
+
+    return lock
+
+def apply(instance, lock):
+    """Overrides instance attributes with ones recorded in a lock. Locked
+    values are final, they don't go through searches again."""
+    for key, value in lock.iteritems():
+        if key == 'block-devices':
+            for device, block_device in value.iteritems():
+                instance.setdefault('block-devices', {}) \
+                        .setdefault(device, {}) \
+                        .update(block_device)
+        else:
+            instance[key] = value
+
+    # VPC is only used to scope searches for security groups and subnets
+    instance.pop('vpc', None)
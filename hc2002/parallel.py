@@ -0,0 +1,111 @@
+import Queue
+import sys
+import threading
+
+import hc2002.config as config
+
+# Thread-local attributes worker threads inherit from the thread starting them
+_inherited = []
+
+def inherit(local, *attributes):
+    """Registers thread-local attributes to be copied into worker threads.
+    Values are shared, not copied, so they should be immutable."""
+    for attribute in attributes:
+        _inherited.append((local, attribute))
+
+def _call(function, item):
+    try:
+        return function(item), None
+    except Exception:
+        return None, sys.exc_info()
+
+# Worker threads are kept around once started, so thread-local state, e.g.,
+# AWS connections, is reused across calls. Busy workers are never waited on,
+# new ones are started instead, so nested calls can't deadlock. Workers left
+# idle beyond jobs * lookup_jobs exit.
+_idle = Queue.Queue()
+
+class _Worker(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.jobs = Queue.Queue()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                job()
+            finally:
+                # Don't leak inherited state into unrelated jobs
+                for local, attribute in _inherited:
+                    if hasattr(local, attribute):
+                        delattr(local, attribute)
+            if _idle.qsize() >= config.jobs * config.lookup_jobs:
+                return
+            _idle.put(self)
+
+def _start(job):
+    try:
+        worker = _idle.get_nowait()
+    except Queue.Empty:
+        worker = _Worker()
+        worker.start()
+    worker.jobs.put(job)
+
+def imap_unordered(function, items, workers=None):
+    """Applies function to each item on a bounded pool of threads.
+
+    Yields (index, result, exc_info) tuples as calls complete. Exceptions are
+    not raised, exc_info is None for calls that succeeded.
+    """
+    items = list(items)
+    if workers is None: workers = config.jobs
+    workers = max(1, min(workers, len(items)))
+
+    if workers == 1:
+        for i, item in enumerate(items):
+            yield (i,) + _call(function, item)
+        return
+
+    tasks = Queue.Queue()
+    results = Queue.Queue()
+    for i, item in enumerate(items):
+        tasks.put((i, item))
+
+    inherited = [ (local, attribute, getattr(local, attribute))
+            for local, attribute in _inherited if hasattr(local, attribute) ]
+
+    def _job():
+        for local, attribute, value in inherited:
+            setattr(local, attribute, value)
+        while True:
+            try:
+                i, item = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            results.put((i,) + _call(function, item))
+
+    for _ in range(workers):
+        _start(_job)
+
+    for _ in items:
+        # A timeout keeps the wait interruptible, e.g., by Ctrl-C
+        yield results.get(True, 86400)
+
+def map(function, items, workers=None):
+    """Like the builtin map, but runs calls concurrently. Results are returned
+    in the order of items. The exception raised by the first failing item, if
+    any, is re-raised after all calls complete.
+    """
+    items = list(items)
+    results = [ None ] * len(items)
+    errors = [ None ] * len(items)
+    for i, result, exc_info in imap_unordered(function, items, workers):
+        results[i] = result
+        errors[i] = exc_info
+
+    for exc_info in errors:
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+    return results
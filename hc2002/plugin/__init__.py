@@ -1,4 +1,28 @@
+import contextlib
+import copy
+import fnmatch
 import importlib
+import json
+import sys
+import threading
+import hc2002.config as config
+import hc2002.instrumentation as instrumentation
+import hc2002.parallel as parallel
+
+# Plugins are registered by module name, per resource module name. Modules are
+# only imported once plugins are applied to a resource.
+#
+# Plugin modules declare the keys they read and write, as lists of glob
+# patterns, in module attributes 'reads' and 'writes'. Plugins that don't
+# touch the same keys may run concurrently, others run in registration order.
+# Undeclared plugins are assumed to read and write everything.
+_plugins = {}
+_schedules = {}
+
+def _name(module):
+    if isinstance(module, basestring):
+        return module
+    return module.__name__
 
 def _resolve(resource):
     if isinstance(resource, basestring):
@@ -6,24 +30,148 @@ def _resolve(resource):
     return resource
 
 def register_for_resource(plugin, resource):
-    resource = _resolve(resource)
+    """Registers a plugin for a resource. Plugins registered last are applied
+    first. Registering a plugin again keeps its original position."""
+    plugins = _plugins.setdefault(_name(resource), [])
 
-    # TODO: There isn't really a need for plugin lists to live in the resource
-    # namespace, they could be maintained in this module.
-    if not hasattr(resource, 'plugins'):
-        resource.plugins = []
-    resource.plugins.insert(0, plugin)
+    plugin = _name(plugin)
+    if plugin not in plugins:
+        plugins.insert(0, plugin)
 
-def apply_for_resource(resource, data):
-    resource = _resolve(resource)
+def _user_data_size(data):
+    if not isinstance(data, dict) or data.get('user-data') is None:
+        return 0
+    user_data = data['user-data']
+    if isinstance(user_data, basestring):
+        return len(user_data)
+    return sum(len(entry) for entry in user_data
+            if isinstance(entry, basestring))
+
+def _overlap(keys, other_keys):
+    for k in keys:
+        for o in other_keys:
+            if fnmatch.fnmatchcase(k, o) or fnmatch.fnmatchcase(o, k):
+                return True
+    return False
+
+def _conflict(plugin, other):
+    reads = getattr(plugin, 'reads', [ '*' ])
+    writes = getattr(plugin, 'writes', [ '*' ])
+    other_reads = getattr(other, 'reads', [ '*' ])
+    other_writes = getattr(other, 'writes', [ '*' ])
 
-    if not hasattr(resource, 'plugins'):
-        return
+    return _overlap(writes, list(other_reads) + list(other_writes)) \
+            or _overlap(reads, other_writes)
 
-    for plugin in resource.plugins:
-        plugin = _resolve(plugin)
+def _schedule(plugins):
+    """Groups plugins into stages. A plugin is placed in the stage after the
+    last plugin, ahead of it in the list, that it conflicts with. Plugins in
+    the same stage don't conflict with each other."""
+    levels = []
+    for i, plugin in enumerate(plugins):
+        level = 0
+        for j in range(i):
+            if _conflict(plugins[j], plugin):
+                level = max(level, levels[j] + 1)
+        levels.append(level)
 
-        if not hasattr(plugin, 'apply'):
-            continue
+    stages = [ [] for _ in range(max(levels) + 1) ] if levels else []
+    for plugin, level in zip(plugins, levels):
+        stages[level].append(plugin)
+    return stages
 
+def _get_schedule(resource):
+    plugins = _plugins.get(_name(resource), [])
+
+    # Importing plugins may register further plugins
+    while True:
+        names = tuple(plugins)
+        modules = [ _resolve(plugin) for plugin in names ]
+        if names == tuple(plugins):
+            break
+
+    if names not in _schedules:
+        _schedules[names] = _schedule(
+                [ m for m in modules if hasattr(m, 'apply') ])
+    return _schedules[names]
+
+def _apply(plugin, data):
+    with instrumentation.stage(_name(plugin)):
+        # Concurrent plugins never write the same keys, so only those that
+        # write user-data are accounted for it
+        if instrumentation.current() is None \
+                or not _overlap([ 'user-data' ],
+                    getattr(plugin, 'writes', [ '*' ])):
+            plugin.apply(data)
+            return
+
+        size = _user_data_size(data)
         plugin.apply(data)
+        instrumentation.add_user_data(_user_data_size(data) - size)
+
+def apply_for_resource(resource, data):
+    for stage in _get_schedule(resource):
+        if len(stage) == 1:
+            _apply(stage[0], data)
+        else:
+            parallel.map(lambda plugin: _apply(plugin, data), stage,
+                    config.lookup_jobs)
+
+class _Lookup:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.exc_info = None
+
+class Batch:
+    """Lookups shared by plugins across instances in a batch. Each distinct
+    lookup is computed once, concurrent requests for a lookup in progress
+    wait for its result."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lookups = {}
+
+    def lookup(self, key, compute):
+        with self.lock:
+            owner = key not in self.lookups
+            if owner:
+                self.lookups[key] = _Lookup()
+            lookup = self.lookups[key]
+
+        if owner:
+            try:
+                lookup.value = compute()
+            except Exception:
+                lookup.exc_info = sys.exc_info()
+            lookup.done.set()
+        else:
+            lookup.done.wait()
+
+        if lookup.exc_info is not None:
+            raise lookup.exc_info[0], lookup.exc_info[1], lookup.exc_info[2]
+        # Instances are free to modify their values
+        return copy.deepcopy(lookup.value)
+
+_local = threading.local()
+parallel.inherit(_local, 'batch')
+
+@contextlib.contextmanager
+def batch():
+    """Shares lookups made by plugins, in this thread and worker threads it
+    starts, until the context exits."""
+    previous = getattr(_local, 'batch', None)
+    _local.batch = Batch()
+    try:
+        yield _local.batch
+    finally:
+        _local.batch = previous
+
+def lookup(key, compute):
+    """Returns compute(), or the result of an earlier lookup with the same key
+    if called within a batch. key may be any JSON serializable value."""
+    current = getattr(_local, 'batch', None)
+    if current is None:
+        return compute()
+    return current.lookup(json.dumps(key, sort_keys=True, default=repr),
+            compute)
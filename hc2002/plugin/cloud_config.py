@@ -4,6 +4,9 @@ import yaml
 
 plugin.register_for_resource(__name__, 'hc2002.resource.instance')
 
+reads = [ 'cloud-config', 'user-data' ]
+writes = reads
+
 def apply(instance):
     if 'cloud-config' not in instance:
         return
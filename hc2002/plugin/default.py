@@ -1,8 +1,15 @@
-# Load default set of plugins
-import hc2002.plugin.cloud_config
-import hc2002.plugin.manifest
-import hc2002.plugin.puppet
-import hc2002.plugin.search
-import hc2002.plugin.symbolic_values
-import hc2002.plugin.user_data
-import hc2002.plugin.vpc
+# Register default set of plugins. Plugin modules are imported lazily, when
+# first applied. Plugins touching the same keys run in the reverse order of
+# registration.
+import hc2002.plugin as plugin
+
+for name in [
+        'hc2002.plugin.user_data',
+        'hc2002.plugin.cloud_config',
+        'hc2002.plugin.manifest',
+        'hc2002.plugin.puppet',
+        'hc2002.plugin.search',
+        'hc2002.plugin.symbolic_values',
+        'hc2002.plugin.vpc',
+        ]:
+    plugin.register_for_resource(name, 'hc2002.resource.instance')
@@ -2,7 +2,8 @@ import hc2002.config as config
 import hc2002.manifest
 import hc2002.plugin as plugin
 import hc2002.plugin.user_data
-from hc2002.validation import validate
+from hc2002.validation import ValidationError, validate
+import hashlib
 import os.path
 import yaml
 import logging
@@ -12,13 +13,19 @@ logger.addHandler(logging.NullHandler())
 
 plugin.register_for_resource(__name__, 'hc2002.resource.instance')
 
+reads = [ 'manifest', 'user-data' ]
+writes = reads
+
 def _add_handler(instance):
     filename = os.path.join(config.handler_path, 'manifest.py')
     with open(filename, 'rb') as f:
         handler = f.read()
-    if not handler.startswith('#part-handler'):
-        handler = '#part-handler\n' + handler
-    instance['user-data'].append(handler)
+
+    # The handler is sent with every instance, comments and blank lines only
+    # take up user-data
+    handler = ''.join(line for line in handler.splitlines(True)
+            if line.strip() and not line.lstrip().startswith('#'))
+    instance['user-data'].append('#part-handler\n' + handler)
 
 def _process_manifest_tag(instance):
     if 'manifest' not in instance:
@@ -53,16 +60,28 @@ def _validate_manifests(instance):
             continue
         scope = 'user-data[%i]' % i
 
-        #FIXME: Should either move file inlining earlier or validation
-        #       later. Should NOT read the file twice. Live as plugin of a
-        #       user-data plugin? :-)
+        # Files are read once, and shared with the user-data plugin
         if entry.startswith('file:'):
             scope += ':%s:' % entry[5:]
-            entry = open(entry[5:], 'rb').read()
+            entry = hc2002.plugin.user_data.read_file(entry[5:])
 
         if entry.startswith('#manifest\n'):
-            logger.debug("Validating manifest %s:\n", entry)
-            validate(hc2002.manifest, yaml.safe_load(entry), scope)
+            _validate_manifest(entry, scope)
+
+def _validate_manifest(entry, scope):
+    # Manifests shared by instances in a batch are parsed and validated once,
+    # wherever they appear. Errors are scoped to each appearance.
+    digest = hashlib.sha1(entry).hexdigest()
+    def _validate():
+        logger.debug("Validating manifest %s:\n", entry)
+        try:
+            validate(hc2002.manifest, yaml.safe_load(entry))
+        except ValidationError as err:
+            return [ line for line in str(err).split('\n') if line ]
+    errors = plugin.lookup([ 'manifest', digest ], _validate)
+    if errors:
+        raise ValidationError('\n'.join([ '%s%s\n' % (scope, error)
+                for error in errors ]))
 
 def apply(instance):
     _process_manifest_tag(instance)
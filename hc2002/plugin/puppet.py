@@ -2,29 +2,115 @@ import hc2002.config as config
 import hc2002.plugin as plugin
 import hc2002.plugin.cloud_config
 import hc2002.plugin.user_data
+import base64
+import cStringIO
+import gzip
+import logging
+import os
 import os.path
+import tarfile
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 plugin.register_for_resource(__name__, 'hc2002.resource.instance')
 
+reads = [ 'puppet', 'puppet-bundle', 'cloud-config', 'user-data' ]
+writes = reads
+
 def _load_manifest(name):
     if not name.endswith('.pp'):
         name = name + '.pp'
 
+    # Instances in a batch share manifests
+    return plugin.lookup([ 'puppet', name, config.puppet_path ],
+            lambda: _read_manifest(name))
+
+def _listing(directory):
+    # Only directories manifests are looked up in are listed, once per batch
+    def _list():
+        try:
+            return frozenset(os.listdir(directory))
+        except OSError:
+            return frozenset()
+    return plugin.lookup([ 'puppet-listing', directory ], _list)
+
+def _find_manifests(name):
+    # Earlier directories in puppet_path take precedence
     for path in config.puppet_path:
-        filename = os.path.join(path, name)
+        filename = os.path.normpath(os.path.join(path, name))
+        if os.path.basename(filename) \
+                in _listing(os.path.dirname(filename) or '.') \
+                and os.path.isfile(filename):
+            yield filename
+
+def _read_manifest(name):
+    for filename in _find_manifests(name):
         try:
-            with open(filename) as f:
-                puppet = f.read()
-            if not puppet.startswith('#!/usr/bin/puppet'):
-                puppet = '#!/usr/bin/puppet apply\n' + puppet
-            return puppet
+            puppet = hc2002.plugin.user_data.read_file(filename)
         except IOError:
-            pass
+            continue
+
+        logger.info('Using puppet manifest %s for \'%s\'', filename, name)
+        if not puppet.startswith('#!/usr/bin/puppet'):
+            puppet = '#!/usr/bin/puppet apply\n' + puppet
+        return puppet
 
     raise Exception('Couldn\'t find puppet manifest for \'%s\' in %s' \
             % (name, config.puppet_path))
 
+_bundle_script = """#!/bin/sh
+set -e
+bundle=$(mktemp -d /tmp/hc2000-puppet.XXXXXX)
+trap 'rm -rf "$bundle"' EXIT
+base64 -d <<'EOF' | tar -xzf - -C "$bundle"
+%s
+EOF
+puppet apply --modulepath "%s" "$bundle/site.pp"
+"""
+
+def _add_file(tar, name, data, mode=0644):
+    # Entries have no timestamps or owners, so bundles are deterministic
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = mode
+    tar.addfile(info, cStringIO.StringIO(data))
+
+def _add_tree(tar, path, name):
+    for root, directories, files in os.walk(path):
+        directories.sort()
+        for f in sorted(files):
+            filename = os.path.join(root, f)
+            mode = 0755 if os.access(filename, os.X_OK) else 0644
+            _add_file(tar, os.path.join(name, os.path.relpath(filename, path)),
+                    hc2002.plugin.user_data.read_file(filename), mode)
+
+def _bundle(manifests):
+    modules = [ os.path.join(path, 'modules') for path in config.puppet_path
+            if os.path.isdir(os.path.join(path, 'modules')) ]
+
+    buffer = cStringIO.StringIO()
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buffer, mtime=0) as gz:
+        tar = tarfile.open(fileobj=gz, mode='w')
+        _add_file(tar, 'site.pp', '\n'.join(_load_manifest(manifest)
+                for manifest in manifests))
+        for i, path in enumerate(modules):
+            _add_tree(tar, path, 'modules/%i' % i)
+        tar.close()
+
+    # Module directories keep their puppet_path precedence
+    module_path = ':'.join('$bundle/modules/%i' % i
+            for i in range(len(modules)))
+    return _bundle_script % (base64.encodestring(buffer.getvalue()).strip(),
+            module_path)
+
+def _load_bundle(manifests):
+    # Instances in a batch share bundles
+    return plugin.lookup([ 'puppet-bundle', manifests, config.puppet_path ],
+            lambda: _bundle(manifests))
+
 def apply(instance):
+    bundle = instance.pop('puppet-bundle', False)
     if 'puppet' not in instance:
         return
 
@@ -43,8 +129,12 @@ def apply(instance):
     if isinstance(instance['puppet'], basestring):
         instance['puppet'] = [ instance['puppet'] ]
 
-    for manifest in instance['puppet']:
-        data = _load_manifest(manifest)
-        instance['user-data'].append(data)
+    # Bundles pack manifests and modules into a single part, applied once
+    if bundle:
+        instance['user-data'].append(_load_bundle(instance['puppet']))
+    else:
+        for manifest in instance['puppet']:
+            data = _load_manifest(manifest)
+            instance['user-data'].append(data)
 
     del instance['puppet']
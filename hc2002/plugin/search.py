@@ -1,5 +1,9 @@
 import hc2002.aws.ec2
 import hc2002.aws.vpc
+import hc2002.cache as cache
+import hc2002.config as config
+import hc2002.index as index
+import hc2002.parallel as parallel
 import hc2002.plugin as plugin
 import logging
 
@@ -8,14 +12,12 @@ logger.addHandler(logging.NullHandler())
 
 plugin.register_for_resource(__name__, 'hc2002.resource.instance')
 
-class NotFound(Exception): pass
-
-def _search(attribute, criteria, query,
-        mappings=None, sort_key=None, item_index=None):
+reads = [ 'image', 'security-groups', 'block-devices', 'subnet' ]
+writes = reads
 
-    if not isinstance(criteria, dict):
-        return criteria
+class NotFound(Exception): pass
 
+def _parameters(criteria, mappings):
     parameters = {}
     filters = criteria.copy()
 
@@ -25,12 +27,34 @@ def _search(attribute, criteria, query,
                 parameters[translate_to] = filters.pop(translate_from)
 
     parameters['filters'] = filters
-    logger.debug('Searching for %s matching: %s', attribute, parameters)
+    return parameters
 
-    results = query(**parameters)
+def _cache_key(attribute, parameters, item_index):
+    return [ config.region, config.aws_access_key, attribute, parameters,
+            item_index ]
+
+def _last(results, sort_key):
+    """Picks the result that would be last if results were sorted by
+    sort_key, in a single pass and without sorting."""
+    best = None
+    best_key = None
+    for r in results:
+        key = sort_key(r)
+        # >= matches the stable sort's choice among equal keys
+        if best is None or key >= best_key:
+            best, best_key = r, key
+    return best
+
+def _select(attribute, parameters, results, sort_key, item_index):
     if not results:
         raise NotFound('No %s matching: %s' % (attribute, parameters))
 
+    # Searches for the latest item keep only the running best match
+    if sort_key and item_index == -1:
+        result = _last(results, sort_key).id
+        logger.debug('Match found: %s (out of %i)', result, len(results))
+        return result
+
     if sort_key:
         results.sort(key=sort_key)
 
@@ -43,17 +67,151 @@ def _search(attribute, criteria, query,
         return results[item_index]
     return results
 
+def _search(attribute, criteria, query,
+        mappings=None, sort_key=None, item_index=None, indexed=None):
+
+    if not isinstance(criteria, dict):
+        return criteria
+
+    parameters = _parameters(criteria, mappings)
+
+    # Instances in a batch share searches
+    return plugin.lookup([ 'search', attribute, parameters, item_index ],
+            lambda: _lookup(attribute, parameters, query, sort_key,
+                    item_index, indexed))
+
+def _lookup(attribute, parameters, query, sort_key, item_index, indexed):
+    # The local index is authoritative for the scopes it holds
+    if indexed is not None:
+        results = index.search(indexed, parameters)
+        if results is not None:
+            return _select(attribute, parameters, results, sort_key,
+                    item_index)
+
+    cache_key = _cache_key(attribute, parameters, item_index)
+    results = cache.get('search', cache_key, config.cache_ttl)
+    if results is not None:
+        logger.debug('Cached match(es) for %s matching %s: %s',
+                attribute, parameters, results)
+        return results
+
+    logger.debug('Searching for %s matching: %s', attribute, parameters)
+
+    results = _select(attribute, parameters, query(**parameters),
+            sort_key, item_index)
+
+    cache.put('search', cache_key, results)
+    return results
+
+def _coalescable(criteria, attributes):
+    """Returns the filter name in which all criteria differ, if they can be
+    merged into a single multi-valued query and told apart by the attribute
+    accessor for that filter. Returns None, otherwise."""
+    keys = set(criteria[0].iterkeys())
+    if any(set(c.iterkeys()) != keys for c in criteria):
+        return None
+
+    differing = [ k for k in keys
+            if any(c[k] != criteria[0][k] for c in criteria) ]
+    if len(differing) != 1:
+        return None
+
+    key = differing[0]
+    if key not in attributes and not key.startswith('tag:'):
+        return None
+
+    # Values are matched exactly on the client-side, that rules out wildcards
+    for c in criteria:
+        if not isinstance(c[key], basestring) \
+                or '*' in c[key] or '?' in c[key]:
+            return None
+    return key
+
+def _attribute_getter(key, attributes):
+    if key.startswith('tag:'):
+        tag = key[4:]
+        return lambda r: r.tags.get(tag)
+    return attributes[key]
+
+def _coalesced_search(attribute, criteria, query, key, attributes,
+        sort_key=None, item_index=None):
+    """Issues a single query for all criteria, which differ only in the value
+    of filter key, and splits results back per criterion."""
+    filters = criteria[0].copy()
+    filters[key] = sorted(set(c[key] for c in criteria))
+
+    logger.debug('Searching for %s matching: %s', attribute, filters)
+    results = query(filters=filters)
+
+    getter = _attribute_getter(key, attributes)
+    matches = []
+    for c in criteria:
+        parameters = _parameters(c, None)
+        found = _select(attribute, parameters,
+                [ r for r in results if getter(r) == c[key] ],
+                sort_key, item_index)
+        cache.put('search', _cache_key(attribute, parameters, item_index),
+                found)
+        matches.append(found)
+    return matches
+
 def _multi_search(attribute, items, query,
-        mappings=None, sort_key=None, item_index=None):
+        mappings=None, sort_key=None, item_index=None, attributes=None):
+    if not _needs_search(items):
+        return items
+
+    return plugin.lookup([ 'multi-search', attribute, items, mappings,
+            item_index ], lambda: _multi_lookup(attribute, items, query,
+                    mappings, sort_key, item_index, attributes))
+
+def _multi_lookup(attribute, items, query,
+        mappings=None, sort_key=None, item_index=None, attributes=None):
     single_item = False
     if not isinstance(items, list):
         single_item = True
         items = [ items ]
 
+    # Results are filled in per item, from cache or by searches below
+    found = [ None ] * len(items)
+    pending = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            found[i] = item
+            continue
+        cache_key = _cache_key(attribute, _parameters(item, mappings),
+                item_index)
+        found[i] = cache.get('search', cache_key, config.cache_ttl)
+        if found[i] is None:
+            pending.append(i)
+
+    # Criteria with the same filter names are candidates for a single
+    # multi-valued query
+    searches = []
+    groups = {}
+    for i in pending:
+        groups.setdefault(tuple(sorted(items[i])), []).append(i)
+    for signature, indices in sorted(groups.iteritems()):
+        criteria = [ items[i] for i in indices ]
+        key = None
+        if attributes is not None and not mappings and len(criteria) > 1:
+            key = _coalescable(criteria, attributes)
+
+        if key is None:
+            for i in indices:
+                searches.append(([ i ], lambda i=i: [ _search(attribute,
+                        items[i], query, mappings, sort_key, item_index) ]))
+        else:
+            searches.append((indices, lambda criteria=criteria, key=key:
+                    _coalesced_search(attribute, criteria, query, key,
+                            attributes, sort_key, item_index)))
+
+    # Searches run in turn, lookups calling this already run concurrently
+    for indices, search in searches:
+        for i, match in zip(indices, search()):
+            found[i] = match
+
     results = []
-    for item in items:
-        search_results = \
-                _search(attribute, item, query, mappings, sort_key, item_index)
+    for search_results in found:
         if isinstance(search_results, list):
             results.extend(search_results)
         else:
@@ -63,45 +221,85 @@ def _multi_search(attribute, items, query,
         return results[0]
     return results
 
-def _image_search(instance):
-    if not 'image' in instance:
-        return
-    ec2 = hc2002.aws.ec2.get_connection()
-    instance['image'] = _search('image',
-            instance['image'], ec2.get_all_images,
+# Accessors for filters that can be matched on the client-side, allowing
+# multiple criteria to be coalesced into a single query. 'tag:<name>' filters
+# are also supported.
+_security_group_attributes = {
+    'group-id':             lambda r: r.id,
+    'group-name':           lambda r: r.name,
+    'vpc-id':               lambda r: r.vpc_id,
+}
+
+_subnet_attributes = {
+    'subnet-id':            lambda r: r.id,
+    'vpc-id':               lambda r: r.vpc_id,
+    'cidr':                 lambda r: r.cidr_block,
+    'cidr-block':           lambda r: r.cidr_block,
+    'availability-zone':    lambda r: r.availability_zone,
+}
+
+def _query(connection, method):
+    # Connections are kept per thread, so they're looked up by the thread
+    # issuing the query
+    def _query(**parameters):
+        return getattr(connection.get_connection(), method)(**parameters)
+    return _query
+
+def _image_search(criteria):
+    return _search('image', criteria,
+            _query(hc2002.aws.ec2, 'get_all_images'),
             { 'owner': 'owners', 'executable-by': 'executable_by' },
-            lambda x: x.name, -1)
-
-def _security_group_search(instance):
-    if not 'security-groups' in instance:
-        return
-    ec2 = hc2002.aws.ec2.get_connection()
-    instance['security-groups'] = _multi_search('security group',
-            instance['security-groups'], ec2.get_all_security_groups)
-
-def _snapshot_search(instance):
-    if not 'block-devices' in instance:
-        return
-    ec2 = hc2002.aws.ec2.get_connection()
-    for block_device in instance['block-devices'].itervalues():
-        if not 'source' in block_device:
-            continue
-        block_device['source'] = _search('snapshot',
-                block_device['source'], ec2.get_all_snapshots,
-                { 'owner': 'owner', 'restorable-by': 'restorable_by' },
-                lambda x: x.description, -1)
-
-def _subnet_search(instance):
-    if not 'subnet' in instance:
-        return
-    vpc = hc2002.aws.vpc.get_connection()
-    instance['subnet'] = _multi_search('subnet', instance['subnet'],
-            vpc.get_all_subnets)
+            lambda x: x.name, -1, 'images')
+
+def _security_group_search(criteria):
+    return _multi_search('security group', criteria,
+            _query(hc2002.aws.ec2, 'get_all_security_groups'),
+            attributes=_security_group_attributes)
+
+def _snapshot_search(criteria):
+    return _search('snapshot', criteria,
+            _query(hc2002.aws.ec2, 'get_all_snapshots'),
+            { 'owner': 'owner', 'restorable-by': 'restorable_by' },
+            lambda x: x.description, -1, 'snapshots')
+
+def _subnet_search(criteria):
+    return _multi_search('subnet', criteria,
+            _query(hc2002.aws.vpc, 'get_all_subnets'),
+            attributes=_subnet_attributes)
 
 # TODO: DescribeNetworkInterfaces
 
+def _needs_search(value):
+    if isinstance(value, list):
+        return any(isinstance(v, dict) for v in value)
+    return isinstance(value, dict)
+
+def _lookups(instance):
+    """Returns (container, key, search) tuples for values that need to be
+    searched for. Lookups are independent of each other."""
+    lookups = []
+    if 'image' in instance:
+        lookups.append((instance, 'image', _image_search))
+    if 'security-groups' in instance:
+        lookups.append((instance, 'security-groups', _security_group_search))
+    if 'block-devices' in instance:
+        for block_device in instance['block-devices'].itervalues():
+            if 'source' in block_device:
+                lookups.append((block_device, 'source', _snapshot_search))
+    if 'subnet' in instance:
+        lookups.append((instance, 'subnet', _subnet_search))
+
+    return [ (container, key, search) for container, key, search in lookups
+            if _needs_search(container[key]) ]
+
+def _run_lookup(lookup):
+    container, key, search = lookup
+    return search(container[key])
+
 def apply(instance):
-    _image_search(instance)
-    _security_group_search(instance)
-    _snapshot_search(instance)
-    _subnet_search(instance)
+    lookups = _lookups(instance)
+    results = parallel.map(_run_lookup, lookups, config.lookup_jobs)
+
+    # Results are merged in lookup order, regardless of completion order
+    for (container, key, _), result in zip(lookups, results):
+        container[key] = result
@@ -1,5 +1,6 @@
 import hc2002.plugin as plugin
 import hc2002.config as config
+import string
 
 plugin.register_for_resource(__name__, 'hc2002.resource.instance')
 
@@ -7,25 +8,83 @@ _prefixes = ('availability-zone:', 'image:', 'kernel:', 'key:',
         'load-balancers:', 'ramdisk:', 'security-groups:', 'spot-price:',
         'subnet:', 'vpc:')
 
-def apply(instance):
-    def resolve_symbol(original_value):
-        value = original_value
-        visited = set()
-        while isinstance(value, basestring) \
-                and value.startswith(prefix):
-            value = value.format(region=config.region, **instance)
-            if value in instance \
-                    and value not in visited:
-                visited.add(value)
-                value = instance[value]
+# Symbols may be formatted with any attribute
+reads = [ '*' ]
+writes = [ p[:-1] for p in _prefixes ] + [ p + '*' for p in _prefixes ]
+
+_formatter = string.Formatter()
+
+class _Unresolved(Exception): pass
+
+class _Resolver:
+    """Resolves symbols, each at most once. Symbols are followed through the
+    instance until a value without the symbol's prefix is found."""
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.fields = dict(instance, region=config.region)
+        self.resolved = {}
+        self.failed = {}
+
+    def set(self, key, value):
+        self.instance[key] = value
+        self.fields[key] = value
+
+    def _format(self, value):
+        if '{' not in value:
+            return value
+        try:
+            return _formatter.vformat(value, (), self.fields)
+        except KeyError as err:
+            raise _Unresolved("unknown field '%s' in '%s'"
+                    % (err.args[0], value))
+
+    def _resolve(self, value, prefix, chain):
+        value = self._format(value)
+
+        if value in self.resolved:
+            return self.resolved[value]
+        if value in self.failed:
+            raise _Unresolved(self.failed[value])
+
+        if value in chain:
+            cycle = chain[chain.index(value):] + [ value ]
+            raise _Unresolved('cycle %s'
+                    % ' -> '.join("'%s'" % s for s in cycle))
+        if value not in self.instance:
+            raise _Unresolved("unable to resolve '%s'" % value)
+
+        chain.append(value)
+        try:
+            result = self.instance[value]
+            if isinstance(result, basestring) and result.startswith(prefix):
+                result = self._resolve(result, prefix, chain)
+        except _Unresolved as err:
+            self.failed[value] = err.args[0]
+            raise
+        finally:
+            chain.pop()
+
+        self.resolved[value] = result
+        return result
+
+    def resolve(self, value, prefix, errors):
+        if not isinstance(value, basestring) or not value.startswith(prefix):
+            return value
+
+        try:
+            return self._resolve(value, prefix, [])
+        except _Unresolved as err:
+            message = err.args[0]
+            if message == "unable to resolve '%s'" % value:
+                errors.append("Unable to resolve '%s'" % value)
             else:
-                if original_value == value:
-                    raise Exception("Unable to resolve '%s'" % value)
-                else:
-                    raise Exception(
-                            "While resolving '%s': unable to resolve '%s'"
-                                % (original_value, value))
-        return value
+                errors.append("While resolving '%s': %s" % (value, message))
+            return value
+
+def apply(instance):
+    resolver = _Resolver(instance)
+    errors = []
 
     # Resolve symbols
     for prefix in _prefixes:
@@ -34,9 +93,14 @@ def apply(instance):
             continue
 
         if isinstance(instance[key], basestring):
-            instance[key] = resolve_symbol(instance[key])
+            resolver.set(key, resolver.resolve(instance[key], prefix, errors))
         elif isinstance(instance[key], list):
-            instance[key] = map(resolve_symbol, instance[key])
+            resolver.set(key, [ resolver.resolve(v, prefix, errors)
+                    for v in instance[key] ])
+
+    # Failures are reported together, rather than one at a time
+    if errors:
+        raise Exception('\n'.join(errors))
 
     # Drop resolvable symbols
     for key in instance.keys():
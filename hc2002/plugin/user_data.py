@@ -1,11 +1,27 @@
+import hc2002.cache as cache
+import hc2002.config as config
 import hc2002.plugin as plugin
+import cStringIO
+import gzip
+import hashlib
+import logging
 import os.path
 import email.mime.base
 import email.mime.multipart
 import email.mime.text
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
 plugin.register_for_resource(__name__, 'hc2002.resource.instance')
 
+writes = [ 'user-data', 'user-data-compression',
+        'user-data-compression-threshold', 'user-data-offload' ]
+# Offloading depends on whether instances may be launched later on
+reads = writes + [ 'auto-scaling-group', 'spot-price' ]
+
+class UserDataTooLarge(Exception): pass
+
 _magic_to_mime = {
     '#!':               ('text', 'x-shellscript'),
     '#cloud-boothook':  ('text', 'cloud-boothook'),
@@ -18,20 +34,38 @@ _magic_to_mime = {
     '#manifest':        ('text', 'hc2000-manifest'),
 }
 
-def _read_file(filename):
+def _read(filename):
     with open(filename, 'rb') as f:
-        filename = os.path.basename(filename)
-        return f.read(), filename
+        return f.read()
 
-def _process_entry(entry, filename=None):
+def read_file(filename):
+    """Returns the contents of filename. Within a batch, each file is read
+    once and shared by all plugins and instances."""
+    filename = os.path.abspath(filename)
+    return plugin.lookup([ 'file', filename ], lambda: _read(filename))
+
+def _read_file(filename):
+    return read_file(filename), os.path.basename(filename)
+
+# Bump when changes to rendering invalidate cached user-data
+_render_version = 1
+
+def _part(entry):
     if entry.startswith('file:'):
-        entry, filename = _read_file(entry[5:])
+        return _read_file(entry[5:])
+    return entry, None
+
+def _digest(entry, filename):
+    return hashlib.sha1('%s\0%s' % (filename or '', entry)).hexdigest()
 
-    maintype, subtype = ('application', 'octet-stream')
+def _mime_type(entry):
     for magic, mime in _magic_to_mime.iteritems():
         if entry.startswith(magic):
-            maintype, subtype = mime
-            break
+            return mime
+    return ('application', 'octet-stream')
+
+def _process_entry(entry, filename=None):
+    maintype, subtype = _mime_type(entry)
 
     if maintype == 'text':
         msg = email.mime.text.MIMEText(entry, subtype)
@@ -46,14 +80,133 @@ def _process_entry(entry, filename=None):
 
     return msg
 
+def _gzip(data):
+    # No timestamp, so compressed output is deterministic too
+    buffer = cStringIO.StringIO()
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buffer, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+# Parts cloud-init can't process when fetched through #include
+_inline_only = [ ('application', 'octet-stream'), ('text', 'hc2000-manifest') ]
+
+def _upload(url, entry, expires):
+    import hc2002.resource.blob as blob
+
+    # Unsigned URLs are only readable if the part is public
+    policy = 'public-read' if expires == 0 else None
+    if blob.head(url):
+        logger.debug('Part already uploaded to %s', url)
+        if policy is not None:
+            blob.set_policy(url, policy)
+    else:
+        logger.debug('Uploading part to %s', url)
+        blob.put(url, entry, policy=policy)
+    return blob.url(url, expires)
+
+def _is_count(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool) \
+            and value >= 0
+
+def _offload(parts, offload, deferred):
+    # Parts of at least threshold bytes are uploaded under the url prefix, and
+    # included through URLs presigned for expires seconds, or public URLs if
+    # expires is 0. Returns the parts, and whether any URL was presigned.
+    if not isinstance(offload, dict) or 'url' not in offload:
+        raise Exception('user-data-offload requires a url, got %s' % offload)
+    prefix = offload['url'].rstrip('/')
+    threshold = offload.get('threshold', 4096)
+    expires = offload.get('expires', 3600)
+
+    if not _is_count(threshold):
+        raise Exception('user-data-offload threshold must be a number of '
+                'bytes, got %s' % threshold)
+    if not _is_count(expires):
+        raise Exception('user-data-offload expires must be a number of '
+                'seconds, got %s' % expires)
+
+    # Auto-scaling groups and spot requests launch instances long after
+    # user-data is rendered, possibly once presigned URLs have expired
+    if deferred and 'expires' not in offload:
+        raise Exception('user-data-offload requires an explicit expires for '
+                'auto-scaling groups and spot requests. Use 0 for public '
+                'URLs, or an expiry outliving the group or request.')
+
+    result = []
+    presigned = False
+    for entry, filename in parts:
+        if len(entry) < threshold or _mime_type(entry) in _inline_only:
+            result.append((entry, filename))
+            continue
+
+        # Parts are content addressed, and uploaded once per batch
+        url = '%s/%s' % (prefix, hashlib.sha1(entry).hexdigest())
+        location = plugin.lookup([ 'user-data-offload', url, expires ],
+                lambda: _upload(url, entry, expires))
+        result.append(('#include\n%s\n' % location, filename))
+        presigned = presigned or expires != 0
+    return result, presigned
+
+def _breakdown(parts):
+    lines = []
+    for entry, filename in parts:
+        name = filename or entry.split('\n', 1)[0][:40]
+        lines.append('  %-40s %7i bytes, %7i gzipped'
+                % (name, len(entry), len(_gzip(entry))))
+    return lines
+
+def _render(parts, use_cache=True):
+    digests = [ _digest(entry, filename) for entry, filename in parts ]
+
+    # Rendering is deterministic, so unchanged parts render to the same
+    # user-data, which is cached. Presigned URLs differ on every run, parts
+    # including them are never cached.
+    cache_key = [ _render_version, digests ]
+    user_data = None
+    if use_cache:
+        user_data = cache.get('user-data', cache_key, config.cache_ttl)
+    if user_data is None:
+        boundary = '=' * 15 + hashlib.sha1(''.join(digests)).hexdigest()
+        data = email.mime.multipart.MIMEMultipart(boundary=boundary)
+        for entry, filename in parts:
+            data.attach(_process_entry(entry, filename))
+        user_data = data.as_string()
+        if use_cache:
+            cache.put('user-data', cache_key, user_data)
+    return user_data
+
 def apply(instance):
-    if 'user-data' not in instance \
-            or not isinstance(instance['user-data'], list):
+    compression = instance.pop('user-data-compression', None)
+    threshold = instance.pop('user-data-compression-threshold', 0)
+    offload = instance.pop('user-data-offload', None)
+    if compression not in (None, False, True, 'none', 'gzip'):
+        raise Exception('Unsupported user-data compression: %s' % compression)
+
+    if instance.get('user-data') is None:
         return
 
-    data = email.mime.multipart.MIMEMultipart()
-    for entry in instance['user-data']:
-        data.attach(_process_entry(entry))
+    user_data = instance['user-data']
+    parts = [ (user_data, None) ]
+    if isinstance(user_data, list):
+        parts = [ _part(entry) for entry in user_data ]
+        presigned = False
+        if offload is not None:
+            parts, presigned = _offload(parts, offload,
+                    'auto-scaling-group' in instance or 'spot-price' in instance)
+        user_data = _render(parts, use_cache=not presigned)
+
+    size = len(user_data)
+    if compression in (True, 'gzip') and size >= threshold:
+        user_data = _gzip(user_data)
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info('User data: %i bytes, %i sent\n%s', size, len(user_data),
+                '\n'.join(_breakdown(parts)))
+    if len(user_data) > config.user_data_limit:
+        raise UserDataTooLarge('User data is %i bytes, %i bytes over the '
+                '%i bytes limit:\n%s' % (len(user_data),
+                    len(user_data) - config.user_data_limit,
+                    config.user_data_limit, '\n'.join(_breakdown(parts))))
 
     # Replace user-data with MIME-ified version.
-    instance['user-data'] = data.as_string()
+    instance['user-data'] = user_data
@@ -5,6 +5,9 @@ import re
 
 plugin.register_for_resource(__name__, 'hc2002.resource.instance')
 
+reads = [ 'vpc', 'security-groups', 'subnet' ]
+writes = reads
+
 def _process_security_group(vpc_id, security_group):
     if isinstance(security_group, basestring):
         if not re.match('sg-[0-9a-f]*', security_group):
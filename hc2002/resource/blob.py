@@ -1,9 +1,19 @@
 import boto.exception
 import hc2002.aws.s3
+import hc2002.config as config
+import hc2002.parallel as parallel
+import logging
+import os.path
+import time
 
-def _setup_s3_connection():
-    global s3
-    s3 = hc2002.aws.s3.get_connection()
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Objects of at least _range_threshold bytes are fetched in ranges of
+# _range_size bytes, concurrently. Failed ranges are retried.
+_range_threshold = 64 << 20
+_range_size = 16 << 20
+_range_retries = 3
 
 def _split_url(url):
     if not url.startswith('s3://'):
@@ -12,12 +22,12 @@ def _split_url(url):
     bucket, _, key = url[5:].partition('/')
     return bucket, key
 
-def _get_key(url):
+def _get_key(s3, url):
     bucket, key = _split_url(url)
     return s3.get_bucket(bucket, validate=False).new_key(key)
 
 def head(url):
-    _setup_s3_connection()
+    s3 = hc2002.aws.s3.get_connection()
 
     bucket, key = _split_url(url)
     s3_bucket = s3.get_bucket(bucket, validate=False)
@@ -25,24 +35,89 @@ def head(url):
         return True
     return False
 
-def put(url, blob, replace=True):
-    _setup_s3_connection()
+def put(url, blob, replace=True, policy=None):
+    s3 = hc2002.aws.s3.get_connection()
 
-    key = _get_key(url)
+    key = _get_key(s3, url)
     if isinstance(blob, basestring):
-        return key.set_contents_from_string(blob, replace=replace)
+        return key.set_contents_from_string(blob, replace=replace,
+                policy=policy)
     else:
-        return key.set_contents_from_file(blob, replace=replace)
+        return key.set_contents_from_file(blob, replace=replace,
+                policy=policy)
+
+def set_policy(url, policy):
+    """Applies a canned ACL, e.g., public-read, to an existing object."""
+    s3 = hc2002.aws.s3.get_connection()
+
+    key = _get_key(s3, url)
+    key.set_canned_acl(policy)
+
+def url(url, expires_in=None):
+    """Returns an HTTPS URL for an s3:// url. With expires_in, the URL is
+    presigned and grants access for that many seconds."""
+    s3 = hc2002.aws.s3.get_connection()
+
+    key = _get_key(s3, url)
+    if expires_in:
+        return key.generate_url(expires_in)
+    return key.generate_url(0, query_auth=False)
+
+def _get_range(url, filename, start, end):
+    for attempt in range(1, _range_retries + 1):
+        s3 = hc2002.aws.s3.get_connection()
+
+        key = _get_key(s3, url)
+        try:
+            # Ranges are written in place, through their own file object
+            with open(filename, 'r+b') as f:
+                f.seek(start)
+                key.get_contents_to_file(f,
+                        headers={ 'Range': 'bytes=%i-%i' % (start, end) })
+            return
+        except (boto.exception.BotoClientError,
+                boto.exception.BotoServerError, IOError) as err:
+            if attempt == _range_retries:
+                raise
+            logger.warning('Retrying bytes %i-%i of %s: %s', start, end,
+                    url, err)
+
+def _get_ranges(url, blob, size):
+    start = time.time()
+
+    # Preallocate, so ranges can be written in any order
+    blob.truncate(size)
+    blob.flush()
+
+    parallel.map(lambda offset: _get_range(url, blob.name, offset,
+                min(offset + _range_size, size) - 1),
+            range(0, size, _range_size), config.lookup_jobs)
+    blob.seek(size)
+
+    elapsed = max(time.time() - start, 1e-6)
+    logger.info('Fetched %s, %i bytes in %.1fs, %.1f MB/s', url, size,
+            elapsed, size / elapsed / (1 << 20))
+
+def _is_regular_file(blob):
+    # Ranges are written through the file's name, from its beginning
+    name = getattr(blob, 'name', None)
+    return isinstance(name, basestring) and os.path.isfile(name) \
+            and blob.tell() == 0
 
 def get(url, blob=None):
-    _setup_s3_connection()
+    s3 = hc2002.aws.s3.get_connection()
 
-    key = _get_key(url)
+    key = _get_key(s3, url)
     try:
         if blob is None:
             return key.get_contents_as_string()
-        else:
-            return key.get_contents_to_file(blob)
+        if _is_regular_file(blob):
+            key = key.bucket.get_key(key.name)
+            if key is None:
+                return None
+            if key.size >= _range_threshold:
+                return _get_ranges(url, blob, key.size)
+        return key.get_contents_to_file(blob)
     except boto.exception.BotoServerError as err:
         if err.status != 404:
             raise
@@ -50,7 +125,7 @@ def get(url, blob=None):
     return None
 
 def list(url):
-    _setup_s3_connection()
+    s3 = hc2002.aws.s3.get_connection()
 
     bucket, key = _split_url(url)
     if not bucket:
@@ -1,3 +1,4 @@
+import boto.ec2.autoscale
 import boto.ec2.blockdevicemapping
 import boto.exception
 import datetime
@@ -7,6 +8,7 @@ import logging
 
 import hc2002.aws.auto_scaling
 import hc2002.aws.ec2
+import hc2002.instrumentation as instrumentation
 import hc2002.plugin
 import hc2002.resource.load_balancer
 import hc2002.transform as xf
@@ -207,12 +209,13 @@ _block_device_mapping = {
                     ],
     'disposable':   xl.set_key('delete_on_termination'),
 }
+_block_device_plan = xl.compile(_block_device_mapping)
 
 def _xl_block_devices(key):
     def _block_devices(destination, value):
         bdm = boto.ec2.blockdevicemapping.BlockDeviceMapping()
         for k, v in value.iteritems():
-            params = xl.translate(_block_device_mapping, v,
+            params = xl.translate(_block_device_plan, v,
                     { 'delete_on_termination': True })
             bdm[k] = boto.ec2.blockdevicemapping.BlockDeviceType(**params)
         destination[key] = bdm
@@ -330,14 +333,6 @@ _create_auto_scaling_group_mapping = {
 
 # TODO: NetworkInterface
 
-def _setup_auto_scaling_connection():
-    global auto_scaling
-    auto_scaling = hc2002.aws.auto_scaling.get_connection()
-
-def _setup_ec2_connection():
-    global ec2
-    ec2 = hc2002.aws.ec2.get_connection()
-
 _scheduled_auto_scaling_action = {
     'count':        xl.set_key('DesiredCapacity'),
     'min-count':    xl.set_key('MinSize'),
@@ -347,6 +342,14 @@ _scheduled_auto_scaling_action = {
     'recurrence':   xl.set_key('Recurrence'),
 }
 
+_launch_instance_plan = xl.compile(_launch_instance_mapping)
+_launch_spot_instance_plan = xl.compile(_launch_spot_instance_mapping)
+_create_launch_configuration_plan = \
+        xl.compile(_create_launch_configuration_mapping)
+_create_auto_scaling_group_plan = \
+        xl.compile(_create_auto_scaling_group_mapping)
+_scheduled_action_plan = xl.compile(_scheduled_auto_scaling_action)
+
 def _try_and_retry(message, operation, condition, retries=5):
 
     result = None
@@ -370,14 +373,14 @@ def _try_and_retry(message, operation, condition, retries=5):
     return result
 
 def _launch_auto_scaling_group(instance):
-    _setup_auto_scaling_connection()
+    auto_scaling = hc2002.aws.auto_scaling.get_connection()
 
     group_name = instance['auto-scaling-group']
     launcher = instance['launch-configuration']
 
     launcher = auto_scaling.get_all_launch_configurations(names=[ launcher ])
     if len(launcher) == 0:
-        params = xl.translate(_create_launch_configuration_mapping, instance)
+        params = xl.translate(_create_launch_configuration_plan, instance)
         launcher = boto.ec2.autoscale.launchconfig.LaunchConfiguration(
                 auto_scaling, **params)
         _try_and_retry("Creating launch configuration",
@@ -397,7 +400,7 @@ def _launch_auto_scaling_group(instance):
             logger.debug('Checking that load balancers exist: %s', lb)
             hc2002.resource.load_balancer.list(lb)
 
-        params = xl.translate(_create_auto_scaling_group_mapping, instance)
+        params = xl.translate(_create_auto_scaling_group_plan, instance)
         group = boto.ec2.autoscale.group.AutoScalingGroup(
                 auto_scaling, **params)
         auto_scaling.create_auto_scaling_group(group)
@@ -416,7 +419,7 @@ def _launch_auto_scaling_group(instance):
 
     if 'schedule' in instance:
         for name, schedule in instance['schedule'].iteritems():
-            params = xl.translate(_scheduled_auto_scaling_action, schedule)
+            params = xl.translate(_scheduled_action_plan, schedule)
             params['AutoScalingGroupName'] = group_name
             params['ScheduledActionName'] = name
 
@@ -429,18 +432,18 @@ def _launch_auto_scaling_group(instance):
     return True
 
 def _launch_spot_instance(instance):
-    _setup_ec2_connection()
+    ec2 = hc2002.aws.ec2.get_connection()
 
-    params = xl.translate(_launch_spot_instance_mapping, instance)
+    params = xl.translate(_launch_spot_instance_plan, instance)
     return _try_and_retry("Creating spot instance request",
             lambda: ec2.request_spot_instances(**params),
             lambda err: err.status == 400 and err.error_message.endswith(
                 'Invalid IAM Instance Profile name'))
 
 def _launch_instance(instance):
-    _setup_ec2_connection()
+    ec2 = hc2002.aws.ec2.get_connection()
 
-    params = xl.translate(_launch_instance_mapping, instance)
+    params = xl.translate(_launch_instance_plan, instance)
     reservation = _try_and_retry("Launching instances",
             lambda: ec2.run_instances(**params),
             lambda err: err.status == 400 and err.error_message.endswith(
@@ -457,13 +460,16 @@ def _launch_instance(instance):
 
 def launch(instance):
     hc2002.plugin.apply_for_resource(__name__, instance)
-    validate(validator, instance)
-
-    if 'auto-scaling-group' in instance \
-            and instance['auto-scaling-group']:
-        return _launch_auto_scaling_group(instance)
-    elif 'spot-price' in instance \
-            and instance['spot-price']:
-        return _launch_spot_instance(instance)
-    else:
-        return _launch_instance(instance)
+
+    with instrumentation.stage('validation'):
+        validate(validator, instance)
+
+    with instrumentation.stage(__name__):
+        if 'auto-scaling-group' in instance \
+                and instance['auto-scaling-group']:
+            return _launch_auto_scaling_group(instance)
+        elif 'spot-price' in instance \
+                and instance['spot-price']:
+            return _launch_spot_instance(instance)
+        else:
+            return _launch_instance(instance)
@@ -25,10 +25,6 @@ validator = {
     ],
 }
 
-def _setup_iam_connection():
-    global iam
-    iam = hc2002.aws.iam.get_connection()
-
 _policy_effects = { 'allow': 'Allow', 'deny': 'Deny' }
 
 def _translate_role_policy(policy):
@@ -52,6 +48,7 @@ def _create_role(role, path='/'):
     The path argument is only used if the role is being created, it is ignored,
     otherwise.
     """
+    iam = hc2002.aws.iam.get_connection()
     try:
         iam.create_role(role, path=path)
         return True
@@ -70,6 +67,7 @@ def _create_instance_profile(instance_profile, path='/', role=None):
     """
     if role is None: role = instance_profile
 
+    iam = hc2002.aws.iam.get_connection()
     profile_roles = {}
     try:
         iam.create_instance_profile(instance_profile, path=path)
@@ -88,11 +86,13 @@ def _create_instance_profile(instance_profile, path='/', role=None):
 
 def _set_role_policy(role, policy):
     """Sets or resets policies associated with an IAM role."""
+    iam = hc2002.aws.iam.get_connection()
     for name, policy in policy.iteritems():
         policy = _translate_role_policy(policy)
         iam.put_role_policy(role, name, policy)
 
 def _list_role_policies(role):
+    iam = hc2002.aws.iam.get_connection()
     result = { 'marker': None }
     while 'marker' in result:
         result = iam.list_role_policies(role, result['marker']) \
@@ -103,11 +103,12 @@ def _list_role_policies(role):
 
 def _delete_role_policies(role):
     """Deletes all policies from an IAM role."""
+    iam = hc2002.aws.iam.get_connection()
     for policy_name in _list_role_policies(role):
         iam.delete_role_policy(role, policy_name)
 
 def create(role):
-    _setup_iam_connection()
+    iam = hc2002.aws.iam.get_connection()
 
     validate(validator, role)
 
@@ -120,7 +121,7 @@ def create(role):
     iam.add_role_to_instance_profile(role['name'], role['name'])
 
 def delete(name):
-    _setup_iam_connection()
+    iam = hc2002.aws.iam.get_connection()
 
     try:
         iam.remove_role_from_instance_profile(name, name)
@@ -7,9 +7,50 @@ def _translate(translator, result, value):
     else:
         translator(result, value)
 
+def _flatten(translator, actions):
+    if hasattr(translator, '__iter__'):
+        for t in translator:
+            _flatten(t, actions)
+    else:
+        actions.append(translator)
+    return actions
+
+def _action(translator):
+    actions = _flatten(translator, [])
+    if len(actions) == 1:
+        return actions[0]
+
+    def _actions(destination, value):
+        for action in actions:
+            action(destination, value)
+    return _actions
+
+def compile(translator):
+    """Compiles a translator, a dict mapping source keys to actions or nested
+    lists of actions, into a reusable plan, plan(source, destination). Action
+    lists are flattened into a single action per key, once."""
+    if getattr(translator, 'compiled', False):
+        return translator
+
+    actions = dict((key, _action(action))
+            for key, action in translator.iteritems())
+
+    def _plan(source, destination):
+        for key, value in source.iteritems():
+            if value is None: continue
+            action = actions.get(key)
+            if action is not None:
+                action(destination, value)
+    _plan.compiled = True
+    return _plan
+
 def translate(translator, source, destination=None):
     if destination is None: destination = {}
 
+    if getattr(translator, 'compiled', False):
+        translator(source, destination)
+        return destination
+
     for key, value in source.iteritems():
         if value is None: continue
         if key in translator:
@@ -44,18 +85,28 @@ def for_each(action):
 
 def append_to(key, transform=None):
     def _append_to(destination, value):
-        if transform is not None:
-            value = transform(value)
         if key in destination:
             destination[key].append(value)
         else:
             destination[key] = [ value ]
-    return _append_to
+    def _append_to_transform(destination, value):
+        _append_to(destination, transform(value))
+    return _append_to \
+            if transform is None \
+            else _append_to_transform
 
 def switch(options):
+    """Applies the action of the first regex matching the value. options is a
+    list of (regex, action) pairs, tried in order, or a dict, tried in sorted
+    order of its regexes."""
+    if isinstance(options, dict):
+        options = sorted(options.iteritems())
+    options = [ (re.compile(regex), _action(action))
+            for regex, action in options ]
+
     def _switch(destination, value):
-        for regex, action in options.iteritems():
-            if re.match(regex, value):
+        for regex, action in options:
+            if regex.match(value):
                 action(destination, value)
                 return
     return _switch
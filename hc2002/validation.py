@@ -1,6 +1,15 @@
 import re
+import types
+
+# Validators are compiled into checker functions, check(data), returning None
+# when data is valid or a list of errors otherwise. Errors are lists of
+# [ scope, prefix, expected, value ] and are only built on failure, scopes are
+# prepended as errors propagate up to validate().
 
 class Context:
+    """Validation state passed to plain validator functions, called as
+    validator(data, context)."""
+
     def __init__(self, initial_scope=None):
         self.scope = []
         self.errors = []
@@ -20,7 +29,39 @@ class Context:
         return len(self.errors) == 0
     __nonzero__ = __bool__
 
-def as_validator(validator):
+def _compiled(check):
+    check.compiled = True
+    return check
+
+def _error(expected, value):
+    return [ '', '', expected, value ]
+
+def _message(error):
+    _, prefix, expected, value = error
+    if expected is None:
+        # Pre-formatted message, from a plain validator function
+        return prefix + value
+    return '%sExpected %s, got %s' % (prefix, expected, value)
+
+def _valid(data):
+    return None
+
+def _function(validator):
+    # Adapts a plain validator(data, context) function
+    def _check(data):
+        context = Context()
+        validator(data, context)
+        if context.errors:
+            return [ [ scope, '', None, message ]
+                    for scope, message in context.errors ]
+    return _compiled(_check)
+
+def compile(validator):
+    """Resolves a validator specification (types, lists, dicts, objects with
+    a validator attribute, and validator functions) into a checker function,
+    once. Specifications nested in dicts and lists are resolved eagerly."""
+    if getattr(validator, 'compiled', False):
+        return validator
     if isinstance(validator, type):
         return is_(validator)
     if isinstance(validator, list):
@@ -28,41 +69,67 @@ def as_validator(validator):
     if isinstance(validator, dict):
         return strict_dict(validator)
     if hasattr(validator, 'validator'):
-        return as_validator(validator.validator)
+        return compile(validator.validator)
     if validator is None:
-        return lambda v, c: None
-    return validator
+        return _compiled(_valid)
+    return _function(validator)
+
+as_validator = compile
 
 def _validate(validator, data, context):
-    as_validator(validator)(data, context)
+    for error in compile(validator)(data) or []:
+        context.errors.append((context.get_scope() + error[0],
+                context.get_error_prefix() + _message(error)))
 
 class ValidationError(Exception):
     pass
 
-def validate(validator, data, initial_scope=None):
-    context = Context(initial_scope)
-    _validate(validator, data, context)
+# Compiled specifications of modules, e.g., resource validators, by module
+# name. Other specifications are compiled on every call, callers validating
+# repeatedly should compile them once.
+_compiled_modules = {}
 
-    if len(context.errors):
-        raise ValidationError('\n'.join([ '%s: %s\n' % (scope, msg) \
-                for scope, msg in context.errors ]))
+def validate(validator, data, initial_scope=None):
+    if isinstance(validator, types.ModuleType):
+        name = validator.__name__
+        if name not in _compiled_modules:
+            _compiled_modules[name] = compile(validator)
+        check = _compiled_modules[name]
+    else:
+        check = compile(validator)
+
+    errors = check(data)
+    if errors:
+        scope = initial_scope or ''
+        raise ValidationError('\n'.join([ '%s: %s\n'
+                % (scope + error[0], _message(error)) for error in errors ]))
+
+def _in_scope(errors, scope):
+    for error in errors:
+        error[0] = scope + error[0]
+    return errors
 
 def is_(expected):
-    def _is_(data, context):
+    message = 'element of type %s' % expected.__name__
+    def _is_(data):
         if not isinstance(data, expected):
-            context.error('element of type %s' % expected.__name__,
-                    data)
-    return _is_
+            return [ _error(message, data) ]
+    return _compiled(_is_)
 
 def tolerant_dict(dict_):
-    def _tolerant_dict(data, context):
+    checks = dict((k, compile(v)) for k, v in dict_.iteritems())
+    def _tolerant_dict(data):
+        errors = None
         for k, v in data.iteritems():
             if v is None: continue
-            if k in dict_:
-                context.scope.append('.%s' % k)
-                _validate(dict_[k], v, context)
-                context.scope.pop()
-    return all_of(is_(dict), _tolerant_dict)
+            check = checks.get(k)
+            if check is None: continue
+            failed = check(v)
+            if failed:
+                errors = errors or []
+                errors.extend(_in_scope(failed, '.%s' % k))
+        return errors
+    return all_of(is_(dict), _compiled(_tolerant_dict))
 
 def strict_dict(dict_):
     return all_of(tolerant_dict(dict_), validate_keys(in_(dict_.keys())))
@@ -73,85 +140,115 @@ def in_(*values):
             and hasattr(values[0], '__iter__'):
         values = values[0]
 
-    def _in_(data, context):
-        if data not in values:
-            context.error('value in %s' % values, data)
-    return _in_
+    message = 'value in %s' % (values,)
+    try:
+        lookup = frozenset(values)
+    except TypeError:
+        lookup = values
+
+    def _in_(data):
+        try:
+            found = data in lookup
+        except TypeError:
+            found = data in values
+        if not found:
+            return [ _error(message, data) ]
+    return _compiled(_in_)
 
 def validate_keys(validator):
-    def _validate_keys(data, context):
-        unknown_keys = []
+    check = compile(validator)
+    def _validate_keys(data):
+        errors = None
         for k in data.iterkeys():
-            context.error_prefix.append('Key error. ')
-            _validate(validator, k, context)
-            context.error_prefix.pop()
-    return _validate_keys
+            failed = check(k)
+            if failed:
+                for error in failed:
+                    error[1] = 'Key error. ' + error[1]
+                errors = errors or []
+                errors.extend(failed)
+        return errors
+    return _compiled(_validate_keys)
 
 def validate_values(validator):
-    def _validate_values(data, context):
+    check = compile(validator)
+    def _validate_values(data):
+        errors = None
         for k, v in data.iteritems():
-            context.scope.append('.%s' % k)
-            _validate(validator, v, context)
-            context.scope.pop()
-        pass
-    return _validate_values
+            failed = check(v)
+            if failed:
+                errors = errors or []
+                errors.extend(_in_scope(failed, '.%s' % k))
+        return errors
+    return _compiled(_validate_values)
 
 def all_of(*validators):
-    def _all_of(data, context):
-        errors = len(context.errors)
-        for v in validators:
-            _validate(v, data, context) 
-            if len(context.errors) != errors:
-                break
-    return _all_of
+    checks = [ compile(v) for v in validators ]
+    if len(checks) == 1:
+        return checks[0]
+
+    def _all_of(data):
+        for check in checks:
+            errors = check(data)
+            if errors:
+                return errors
+    return _compiled(_all_of)
 
 def one_of(*validators):
-    def _one_of(data, context):
-        original = len(context.errors)
-        for v in validators:
-            previous = len(context.errors)
-            _validate(v, data, context)
-            if previous == len(context.errors):
-                del context.errors[original:]
-                break
-    return _one_of
+    checks = [ compile(v) for v in validators ]
+    def _one_of(data):
+        errors = []
+        for check in checks:
+            failed = check(data)
+            if not failed:
+                return None
+            errors.extend(failed)
+        return errors
+    return _compiled(_one_of)
 
 def at_most_one_of(*keys):
-    def _at_most_one_of(data, context):
+    message = 'at most one of %s' % (keys,)
+    def _at_most_one_of(data):
         matched = 0
         for k in keys:
             matched += k in data
         if matched > 1:
-            context.error('at most one of %s' % keys, data)
-    return _at_most_one_of
+            return [ _error(message, data) ]
+    return _compiled(_at_most_one_of)
 
 def one_or_more(validator):
-    def _one_or_more(data, context):
+    check = compile(validator)
+    def _one_or_more(data):
         if not isinstance(data, list):
-            return _validate(validator, data, context)
+            return check(data)
+        errors = None
         for i, element in enumerate(data):
-            context.scope.append('[%i]' % i)
-            _validate(validator, element, context)
-            context.scope.pop()
-    return _one_or_more
+            failed = check(element)
+            if failed:
+                errors = errors or []
+                errors.extend(_in_scope(failed, '[%i]' % i))
+        return errors
+    return _compiled(_one_or_more)
 
 def prefix(prefix):
-    def _prefix(data, context):
+    message = 'prefix %s' % str(prefix)
+    def _prefix(data):
         if not data.startswith(prefix):
-            context.error('prefix %s' % str(prefix), data)
-    return _prefix
+            return [ _error(message, data) ]
+    return _compiled(_prefix)
 
 path = basestring
 absolute_path = all_of(path, prefix('/'))
 url = basestring
 
-def file_mode(data, context):
+@_compiled
+def file_mode(data):
     if 0777 != data | 0777:
-        context.error("valid file mode (mode | 0777 == 0777)", data)
+        return [ _error("valid file mode (mode | 0777 == 0777)", data) ]
 
 def match(pattern):
     regex = re.compile(pattern)
-    def _match(data, context):
+    message = 'value matching pattern /%s/' % pattern
+    def _match(data):
         if not regex.match(data):
-            context.error('value matching pattern /%s/' % pattern, data)
-    return _match
+            return [ _error(message, data) ]
+    return _compiled(_match)
@@ -0,0 +1,107 @@
+import cStringIO
+import hc2002.aws.s3
+import hc2002.resource.blob as blob
+import os
+import socket
+import tempfile
+import unittest
+
+class _Connection:
+    def __init__(self, objects):
+        self.objects = objects
+        self.requests = []
+        self.failures = set()
+
+    def get_bucket(self, name, validate=True):
+        return self
+
+    def new_key(self, name):
+        return _Key(self, name)
+
+    def get_key(self, name):
+        self.requests.append(('HEAD', None))
+        if name not in self.objects:
+            return None
+        key = _Key(self, name)
+        key.size = len(self.objects[name])
+        return key
+
+class _Key:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.size = None
+
+    def get_contents_as_string(self):
+        buffer = cStringIO.StringIO()
+        self.get_contents_to_file(buffer)
+        return buffer.getvalue()
+
+    def get_contents_to_file(self, file, headers=None):
+        """Fake GET, honouring Range headers and failing ranges once if
+        asked to."""
+        range_ = (headers or {}).get('Range')
+        self.bucket.requests.append(('GET', range_))
+
+        content = self.bucket.objects[self.name]
+        if range_ is not None:
+            start, end = [ int(i) for i in range_[6:].split('-') ]
+            content = content[start:end + 1]
+
+        if range_ in self.bucket.failures:
+            self.bucket.failures.remove(range_)
+            file.write(content[:len(content) / 2])
+            raise socket.error('Connection reset by peer')
+        file.write(content)
+
+class GetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.threshold, blob._range_threshold = blob._range_threshold, 50
+        self.range_size, blob._range_size = blob._range_size, 10
+        self.get_connection = hc2002.aws.s3.get_connection
+        hc2002.aws.s3.get_connection = lambda: self.s3
+
+        self.s3 = _Connection({
+            'large':    ''.join(chr(i) for i in range(95)),
+            'small':    'small',
+        })
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        blob._range_threshold = self.threshold
+        blob._range_size = self.range_size
+        hc2002.aws.s3.get_connection = self.get_connection
+        os.unlink(self.filename)
+
+    def get(self, name):
+        with open(self.filename, 'w+b') as f:
+            blob.get('s3://bucket/' + name, f)
+            self.assertEquals(f.tell(), len(self.s3.objects[name]))
+        with open(self.filename, 'rb') as f:
+            return f.read()
+
+    def gets(self):
+        return sorted(r for m, r in self.s3.requests if m == 'GET')
+
+    def test_ranges(self):
+        self.s3.failures.add('bytes=30-39')
+        self.assertEquals(self.get('large'), blob.get('s3://bucket/large'))
+        # Ranges, one retried, and the single GET compared against
+        self.assertEquals(self.gets(), sorted([ None ] + [ 'bytes=%i-%i'
+                % (i, min(i + 9, 94)) for i in range(0, 95, 10) ]
+                + [ 'bytes=30-39' ]))
+
+    def test_small(self):
+        self.assertEquals(self.get('small'), 'small')
+        self.assertEquals(self.gets(), [ None ])
+
+    def test_stream(self):
+        # Ranges are only written into regular files
+        stream = cStringIO.StringIO()
+        blob.get('s3://bucket/large', stream)
+        self.assertEquals(stream.getvalue(), self.s3.objects['large'])
+        self.assertEquals(self.gets(), [ None ])
+
+if __name__ == '__main__':
+    unittest.main()
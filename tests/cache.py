@@ -0,0 +1,70 @@
+import hc2002.cache as cache
+import hc2002.config as config
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = config.use_cache, config.cache_path
+        config.use_cache = True
+        config.cache_path = os.path.join(self.directory, 'hc2000')
+
+    def tearDown(self):
+        config.use_cache, config.cache_path = self.config
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        value = { 'ids': [ 'ami-1', 'ami-2' ], 'count': 2 }
+        cache.put('search', { 'a': 1, 'b': [ 2, 3 ] }, value)
+        # Dict keys are normalized
+        self.assertEquals(cache.get('search', { 'b': [ 2, 3 ], 'a': 1 }),
+                value)
+        self.assertIsNone(cache.get('search', { 'a': 1 }))
+        self.assertIsNone(cache.get('other', { 'a': 1, 'b': [ 2, 3 ] }))
+        self.assertEquals(cache.get('other', 'key', default=[]), [])
+
+    def test_ttl(self):
+        cache.put('search', 'key', 'value')
+        self.assertEquals(cache.get('search', 'key', 60), 'value')
+
+        # Two minutes later
+        now = time.time
+        time.time = lambda: now() + 120
+        try:
+            self.assertIsNone(cache.get('search', 'key', 60))
+            self.assertEquals(cache.get('search', 'key', 180), 'value')
+            self.assertEquals(cache.get('search', 'key'), 'value')
+        finally:
+            time.time = now
+
+    def test_invalidate(self):
+        cache.put('search', 'key', 'value')
+        cache.put('user-data', 'key', 'value')
+
+        cache.invalidate('search')
+        self.assertIsNone(cache.get('search', 'key'))
+        self.assertEquals(cache.get('user-data', 'key'), 'value')
+
+        cache.invalidate()
+        self.assertIsNone(cache.get('user-data', 'key'))
+
+    def test_disabled(self):
+        cache.put('search', 'key', 'value')
+        config.use_cache = False
+        self.assertIsNone(cache.get('search', 'key'))
+        cache.put('search', 'other', 'value')
+        config.use_cache = True
+        self.assertIsNone(cache.get('search', 'other'))
+
+    def test_corrupt(self):
+        cache.put('search', 'key', 'value')
+        with open(cache._filename('search', 'key'), 'wb') as f:
+            f.write('garbage')
+        self.assertIsNone(cache.get('search', 'key'))
+
+if __name__ == '__main__':
+    unittest.main()
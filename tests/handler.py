@@ -0,0 +1,128 @@
+import boto.exception
+import hc2002.config as config
+import imp
+import os.path
+import shutil
+import socket
+import tempfile
+import unittest
+
+# Handlers are shipped in user-data, rather than imported from hc2002
+manifest = imp.load_source('hc2000_manifest_handler',
+        os.path.join(config.handler_path, 'manifest.py'))
+
+class _Bucket:
+    def __init__(self, objects):
+        self.objects = objects
+        self.requests = []
+        self.failures = set()
+
+    def get_key(self, name):
+        self.requests.append(('HEAD', name))
+        if name not in self.objects:
+            return None
+        key = _Key(self, name)
+        key.size = len(self.objects[name])
+        key.etag = '"%s"' % manifest.hashlib.md5(self.objects[name]) \
+                .hexdigest()
+        return key
+
+class _Key:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.size = None
+
+    def get_contents_to_file(self, file, headers=None):
+        """Fake GET, honouring Range headers and failing ranges once if
+        asked to."""
+        range_ = (headers or {}).get('Range')
+        self.bucket.requests.append(('GET', range_))
+
+        content = self.bucket.objects[self.name]
+        self.size = len(content)
+        if range_ is not None:
+            start, end = [ int(i) for i in range_[6:].split('-') ]
+            if start >= len(content):
+                raise boto.exception.S3ResponseError(416,
+                        'Requested Range Not Satisfiable')
+            content = content[start:end + 1]
+
+        if range_ in self.bucket.failures:
+            self.bucket.failures.remove(range_)
+            file.write(content[:len(content) / 2])
+            raise socket.error('Connection reset by peer')
+        file.write(content)
+
+class HandlerFetchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.range_size, manifest._range_size = manifest._range_size, 10
+        self.get_key = manifest._get_key
+        manifest._get_key = lambda data, source: \
+                _Key(self.bucket, source[len('s3://bucket/'):])
+
+        self.directory = tempfile.mkdtemp()
+        self.bucket = _Bucket({
+            'large':    ''.join(chr(i) for i in range(95)),
+            'small':    'small',
+            'empty':    '',
+        })
+
+    def tearDown(self):
+        manifest._range_size = self.range_size
+        manifest._get_key = self.get_key
+        shutil.rmtree(self.directory)
+
+    def create(self, *names):
+        data = manifest._HC2000()
+        for name in names:
+            data.files[os.path.join(self.directory, name)] = {
+                'source':   's3://bucket/' + name,
+                'content':  None,
+                'target':   None,
+                'mode':     0644,
+                'uid':      -1,
+                'gid':      -1,
+            }
+        manifest._create(data)
+        return data
+
+    def content(self, name):
+        with open(os.path.join(self.directory, name), 'rb') as file:
+            return file.read()
+
+    def gets(self):
+        return sorted(r for m, r in self.bucket.requests if m == 'GET')
+
+    def test_ranges(self):
+        self.bucket.failures.add('bytes=30-39')
+        data = self.create('large', 'small', 'empty')
+
+        for name in [ 'large', 'small', 'empty' ]:
+            self.assertEquals(self.content(name), self.bucket.objects[name])
+        self.assertEquals((data.fetched, data.skipped, data.bytes),
+                (3, 0, 100))
+        # One request per range, the failed one retried, and no HEAD for
+        # files that weren't there yet
+        self.assertEquals(self.gets(), sorted([ 'bytes=0-9' ] * 3 + [
+            'bytes=%i-%i' % (i, i + 9) for i in range(10, 100, 10) ]
+            + [ 'bytes=30-39' ]))
+        self.assertEquals(len(self.bucket.requests), 13)
+
+    def test_unchanged(self):
+        self.create('large', 'small')
+        self.bucket.objects['small'] = 'changed'
+        self.bucket.requests = []
+
+        data = self.create('large', 'small')
+        self.assertEquals((data.fetched, data.skipped), (1, 1))
+        self.assertEquals(self.content('small'), 'changed')
+        self.assertEquals(self.gets(), [ 'bytes=0-9' ])
+
+    def test_missing(self):
+        with open(os.path.join(self.directory, 'missing'), 'wb'):
+            pass
+        self.assertRaises(IOError, self.create, 'missing')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import hc2002.config as config
+import hc2002.index as index
+import logging
+import os.path
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+class _Image:
+    def __init__(self, id, name, tags=None):
+        self.id = id
+        self.name = name
+        self.ownerId = '123456789012'
+        self.architecture = 'x86_64'
+        self.tags = tags or {}
+
+class _Handler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class IndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = config.region, config.use_index, config.index_path
+        config.region = 'eu-west-1'
+        config.use_index = True
+        config.index_path = os.path.join(self.directory, 'index.sqlite')
+
+        self.images = [
+            _Image('ami-1', 'base-2013.01', { 'role': 'web' }),
+            _Image('ami-2', 'base-2013.02', { 'role': 'db' }),
+            _Image('ami-3', 'other_2013.01'),
+        ]
+        self.fetch = index._fetch
+        index._fetch = lambda kind, scope: self.images
+
+        self.handler = _Handler()
+        logging.getLogger(index.__name__).addHandler(self.handler)
+        index._stale.clear()
+
+    def tearDown(self):
+        config.region, config.use_index, config.index_path = self.config
+        index._fetch = self.fetch
+        logging.getLogger(index.__name__).removeHandler(self.handler)
+        shutil.rmtree(self.directory)
+
+    def search(self, filters, owners='self'):
+        items = index.search('images', { 'owners': owners,
+                'filters': filters })
+        if items is not None:
+            return sorted(item.id for item in items)
+
+    def test_refresh(self):
+        self.assertEquals(index.refresh('images', 'self'), (3, 0, 3))
+        self.assertEquals(index.refresh('images', 'self'), (0, 0, 3))
+
+        self.images[0].tags = { 'role': 'cache' }
+        del self.images[1]
+        self.assertEquals(index.refresh('images', 'self'), (1, 1, 2))
+
+    def test_filters(self):
+        index.refresh('images', 'self')
+
+        self.assertEquals(self.search({ 'name': 'base-*' }),
+                [ 'ami-1', 'ami-2' ])
+        self.assertEquals(self.search({ 'name': 'base-2013.0?' }),
+                [ 'ami-1', 'ami-2' ])
+        # Wildcards are the only special characters
+        self.assertEquals(self.search({ 'name': 'other%' }), [])
+        self.assertEquals(self.search({ 'name': 'other_2013.01' }),
+                [ 'ami-3' ])
+        self.assertEquals(self.search({ 'name': 'other?2013?01' }),
+                [ 'ami-3' ])
+        # Multiple values match any of them, filters match all
+        self.assertEquals(self.search({ 'name': [ 'other*', '*.02' ] }),
+                [ 'ami-2', 'ami-3' ])
+        self.assertEquals(self.search({ 'name': 'base-*',
+                'tag:role': [ 'w*', 'cache' ] }), [ 'ami-1' ])
+        self.assertEquals(self.search({ 'tag:missing': '*' }), [])
+
+    def test_unanswered(self):
+        index.refresh('images', 'self')
+
+        # Unsupported filters, and scopes never synced
+        self.assertIsNone(self.search({ 'block-device-mapping.volume-size':
+                '8' }))
+        self.assertIsNone(self.search({}, [ 'self', 'amazon' ]))
+        self.assertIsNone(index.search('images', { 'image_ids': [ 'ami-1' ],
+                'owners': 'self' }))
+        config.region = 'us-east-1'
+        self.assertIsNone(self.search({}))
+
+    def test_stale(self):
+        index.refresh('images', 'self')
+        self.assertEquals(self.search({}), [ 'ami-1', 'ami-2', 'ami-3' ])
+        self.assertEquals(self.handler.messages, [])
+
+        db = sqlite3.connect(config.index_path)
+        with db:
+            db.execute('UPDATE syncs SET synced_at = ?',
+                    (time.time() - 2 * config.index_max_age,))
+        db.close()
+
+        self.search({})
+        self.search({ 'name': 'base-*' })
+        self.assertEquals(len(self.handler.messages), 1)
+        self.assertIn('last synced 2.0 days ago', self.handler.messages[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import hc2002.lock as lock
+import os.path
+import shutil
+import tempfile
+import unittest
+
+class LockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'hc2000.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        resolved = {
+            'image':            'ami-12345678',
+            'security-groups':  [ 'sg-1', 'sg-2' ],
+            'subnet':           'subnet-1',
+            'vpc':              'vpc-1',
+            'instance-type':    'm1.small',
+            'block-devices':    {
+                '/dev/sdf':     { 'source': 'snap-1', 'size': 10 },
+                '/dev/sdg':     { 'size': 20 },
+            },
+        }
+        lock.save(self.filename, { 'web': lock.record(resolved) })
+
+        instance = {
+            'image':            { 'name': 'base-*' },
+            'security-groups':  [ { 'group-name': 'web' } ],
+            'subnet':           'subnet:web',
+            'vpc':              'vpc-1',
+            'instance-type':    'm1.large',
+            'block-devices':    {
+                '/dev/sdf':     { 'source': { 'description': 'data' },
+                    'size': 10 },
+            },
+        }
+        locks = lock.load(self.filename)
+        lock.apply(instance, lock.get(locks, 'web', self.filename))
+        self.assertEquals(instance, {
+            'image':            'ami-12345678',
+            'security-groups':  [ 'sg-1', 'sg-2' ],
+            'subnet':           'subnet-1',
+            'instance-type':    'm1.large',
+            'block-devices':    {
+                '/dev/sdf':     { 'source': 'snap-1', 'size': 10 },
+            },
+        })
+
+    def test_missing(self):
+        self.assertEquals(lock.load(self.filename), {})
+
+        lock.save(self.filename, { 'web': { 'image': 'ami-12345678' } })
+        locks = lock.load(self.filename)
+        self.assertEquals(lock.get(locks, 'web', self.filename),
+                { 'image': 'ami-12345678' })
+        self.assertRaises(lock.MissingLock, lock.get, locks, 'db',
+                self.filename)
+
+if __name__ == '__main__':
+    unittest.main()
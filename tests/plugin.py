@@ -0,0 +1,67 @@
+import hc2002.plugin as plugin
+import hc2002.plugin.default
+import types
+import unittest
+
+def _plugin(name, reads=None, writes=None):
+    module = types.ModuleType(name)
+    module.apply = lambda data: None
+    if reads is not None:
+        module.reads = reads
+    if writes is not None:
+        module.writes = writes
+    return module
+
+def _names(stages):
+    return [ [ p.__name__.rsplit('.', 1)[-1] for p in stage ]
+            for stage in stages ]
+
+class ScheduleTestCase(unittest.TestCase):
+    def setUp(self):
+        self.plugins, plugin._plugins = plugin._plugins, {}
+        self.schedules, plugin._schedules = plugin._schedules, {}
+
+    def tearDown(self):
+        plugin._plugins = self.plugins
+        plugin._schedules = self.schedules
+
+    def test_default_schedule(self):
+        # Plugin modules register themselves when imported, e.g., by other
+        # tests, so registration starts over from the default set
+        reload(hc2002.plugin.default)
+        stages = plugin._get_schedule('hc2002.resource.instance')
+        self.assertEquals(_names(stages), [
+            [ 'vpc' ],
+            [ 'symbolic_values' ],
+            [ 'search', 'puppet' ],
+            [ 'manifest' ],
+            [ 'cloud_config' ],
+            [ 'user_data' ],
+        ])
+
+    def test_independent_plugins_share_a_stage(self):
+        a = _plugin('a', [ 'a' ], [ 'a' ])
+        b = _plugin('b', [ 'b' ], [ 'b' ])
+        c = _plugin('c', [ 'a', 'b' ], [ 'c' ])
+        self.assertEquals(_names(plugin._schedule([ a, b, c ])),
+                [ [ 'a', 'b' ], [ 'c' ] ])
+
+    def test_patterns(self):
+        a = _plugin('a', [ 'user-data' ], [ 'user-data' ])
+        b = _plugin('b', [ 'user-*' ], [ 'other' ])
+        c = _plugin('c', [ 'image' ], [ 'image' ])
+        self.assertEquals(_names(plugin._schedule([ a, b, c ])),
+                [ [ 'a', 'c' ], [ 'b' ] ])
+
+    def test_undeclared_plugin_is_a_barrier(self):
+        a = _plugin('a', [ 'a' ], [ 'a' ])
+        b = _plugin('b', [ 'b' ], [ 'b' ])
+        undeclared = _plugin('undeclared')
+        c = _plugin('c', [ 'c' ], [ 'c' ])
+        d = _plugin('d', [ 'd' ], [ 'd' ])
+        self.assertEquals(
+                _names(plugin._schedule([ a, b, undeclared, c, d ])),
+                [ [ 'a', 'b' ], [ 'undeclared' ], [ 'c', 'd' ] ])
+
+if __name__ == '__main__':
+    unittest.main()
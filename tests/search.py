@@ -0,0 +1,104 @@
+import hc2002.config as config
+import hc2002.plugin.search as search
+import unittest
+
+class _Group:
+    def __init__(self, id, name, vpc_id, tags=None):
+        self.id = id
+        self.name = name
+        self.vpc_id = vpc_id
+        self.tags = tags or {}
+
+class MultiSearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.use_cache, config.use_cache = config.use_cache, False
+        self.use_index, config.use_index = config.use_index, False
+
+        self.groups = [
+            _Group('sg-a', 'a', 'vpc-1', { 'role': 'web' }),
+            _Group('sg-b', 'b', 'vpc-1', { 'role': 'db' }),
+            _Group('sg-c', 'c', 'vpc-2'),
+        ]
+        self.queries = []
+
+    def tearDown(self):
+        config.use_cache = self.use_cache
+        config.use_index = self.use_index
+
+    def query(self, filters):
+        """Fake DescribeSecurityGroups, supporting exact matches only."""
+        self.queries.append(filters)
+
+        def _matches(group):
+            for name, values in filters.iteritems():
+                if not isinstance(values, list):
+                    values = [ values ]
+                getter = search._attribute_getter(name,
+                        search._security_group_attributes)
+                if getter(group) not in values:
+                    return False
+            return True
+        return [ g for g in self.groups if _matches(g) ]
+
+    def search(self, criteria):
+        return search._multi_search('security group', criteria, self.query,
+                attributes=search._security_group_attributes)
+
+    def test_merged_filters(self):
+        result = self.search([
+            { 'group-name': 'b', 'vpc-id': 'vpc-1' },
+            { 'group-name': 'a', 'vpc-id': 'vpc-1' },
+        ])
+        self.assertEquals(result, [ 'sg-b', 'sg-a' ])
+        self.assertEquals(self.queries,
+                [ { 'group-name': [ 'a', 'b' ], 'vpc-id': 'vpc-1' } ])
+
+    def test_merged_tag_filters(self):
+        result = self.search([ { 'tag:role': 'db' }, { 'tag:role': 'web' } ])
+        self.assertEquals(result, [ 'sg-b', 'sg-a' ])
+        self.assertEquals(len(self.queries), 1)
+
+    def test_split_per_criterion(self):
+        # Both criteria match sg-a and sg-b as a whole, but each keeps only
+        # its own match
+        result = self.search([ { 'vpc-id': 'vpc-1' }, { 'vpc-id': 'vpc-2' } ])
+        self.assertEquals(result, [ 'sg-a', 'sg-b', 'sg-c' ])
+        self.assertEquals(len(self.queries), 1)
+
+    def test_not_coalesced(self):
+        # Wildcards can't be matched on the client-side
+        self.assertIsNone(search._coalescable(
+                [ { 'group-name': 'a*' }, { 'group-name': 'b' } ],
+                search._security_group_attributes))
+        # Criteria differing in more than one filter
+        self.assertIsNone(search._coalescable(
+                [ { 'group-name': 'a', 'vpc-id': 'vpc-1' },
+                    { 'group-name': 'c', 'vpc-id': 'vpc-2' } ],
+                search._security_group_attributes))
+        # Filters without a client-side accessor
+        self.assertIsNone(search._coalescable(
+                [ { 'description': 'a' }, { 'description': 'b' } ],
+                search._security_group_attributes))
+
+        result = self.search([ { 'group-name': 'c' },
+                { 'group-name': 'c', 'vpc-id': 'vpc-2' } ])
+        self.assertEquals(result, [ 'sg-c', 'sg-c' ])
+        self.assertEquals(len(self.queries), 2)
+
+    def test_result_shape(self):
+        self.assertEquals(self.search({ 'group-name': 'a' }), 'sg-a')
+        self.assertEquals(self.search([ { 'group-name': 'a' } ]), [ 'sg-a' ])
+        self.assertEquals(self.search('sg-x'), 'sg-x')
+        self.assertEquals(self.search([ 'sg-x', { 'group-name': 'a' } ]),
+                [ 'sg-x', 'sg-a' ])
+        self.assertEquals(self.search([ 'sg-x', 'sg-y' ]), [ 'sg-x', 'sg-y' ])
+        # Ids are never searched for
+        self.assertEquals(len(self.queries), 3)
+
+    def test_missing_criterion(self):
+        self.assertRaises(search.NotFound, self.search,
+                [ { 'group-name': 'a' }, { 'group-name': 'missing' } ])
+        self.assertEquals(len(self.queries), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import hc2002.config as config
+import hc2002.plugin.symbolic_values as symbolic_values
+import unittest
+
+class SymbolicValuesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.region, config.region = config.region, 'eu-west-1'
+
+    def tearDown(self):
+        config.region = self.region
+
+    def errors(self, instance):
+        try:
+            symbolic_values.apply(instance)
+        except Exception as err:
+            return str(err).split('\n')
+        self.fail('Expected symbols in %s to fail resolution' % instance)
+
+    def test_resolve(self):
+        instance = {
+            'image':                'image:{region}',
+            'image:eu-west-1':      'image:base',
+            'image:base':           'ami-12345678',
+            'security-groups':      [ 'security-groups:web', 'sg-1' ],
+            'security-groups:web':  'sg-2',
+        }
+        symbolic_values.apply(instance)
+        self.assertEquals(instance, {
+            'image':                'ami-12345678',
+            'security-groups':      [ 'sg-2', 'sg-1' ],
+        })
+
+    def test_field_from_resolved_symbol(self):
+        # availability-zone is resolved ahead of image, which is formatted
+        # with the resolved value
+        instance = {
+            'image':                        'image:{availability-zone}',
+            'availability-zone':            'availability-zone:primary',
+            'availability-zone:primary':    'eu-west-1a',
+            'image:eu-west-1a':             'ami-12345678',
+        }
+        symbolic_values.apply(instance)
+        self.assertEquals(instance, {
+            'image':                'ami-12345678',
+            'availability-zone':    'eu-west-1a',
+        })
+
+    def test_cycle(self):
+        self.assertEquals(self.errors({
+            'image':    'image:a',
+            'image:a':  'image:b',
+            'image:b':  'image:a',
+        }), [ "While resolving 'image:a': cycle 'image:a' -> 'image:b' -> "
+                "'image:a'" ])
+
+    def test_missing_symbol_in_chain(self):
+        self.assertEquals(self.errors({
+            'image':    'image:a',
+            'image:a':  'image:b',
+        }), [ "While resolving 'image:a': unable to resolve 'image:b'" ])
+
+    def test_errors_reported_together(self):
+        self.assertEquals(self.errors({
+            'image':    'image:missing',
+            'key':      'key:{unknown}',
+            'subnet':   [ 'subnet:a', 'subnet:b' ],
+            'subnet:a': 'subnet-12345678',
+        }), [
+            "Unable to resolve 'image:missing'",
+            "While resolving 'key:{unknown}': unknown field 'unknown' in "
+                "'key:{unknown}'",
+            "Unable to resolve 'subnet:b'",
+        ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import hc2002.config as config
+import hc2002.plugin as plugin
+import hc2002.plugin.user_data as user_data
+import os
+import shutil
+import tempfile
+import unittest
+
+_script = '#!/bin/sh\necho hello\n'
+_cloud_config = '#cloud-config\npackages: [ puppet ]\n'
+
+class UserDataTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = config.use_cache, config.cache_path
+        config.use_cache = True
+        config.cache_path = os.path.join(self.directory, 'hc2000')
+
+        self.uploads = []
+        self.upload = user_data._upload
+        user_data._upload = self.fake_upload
+
+    def tearDown(self):
+        config.use_cache, config.cache_path = self.config
+        user_data._upload = self.upload
+        shutil.rmtree(self.directory)
+
+    def fake_upload(self, url, entry, expires):
+        self.uploads.append((url, expires))
+        if expires:
+            return 'https://bucket.s3.amazonaws.com/%s?Expires=%i' \
+                    % (url[len('s3://bucket/'):], len(self.uploads))
+        return 'https://bucket.s3.amazonaws.com/%s' % url[len('s3://bucket/'):]
+
+    def apply(self, **instance):
+        instance.setdefault('user-data', [ _script, _cloud_config ])
+        user_data.apply(instance)
+        return instance['user-data']
+
+    def cached(self):
+        return os.listdir(os.path.join(config.cache_path, 'user-data')) \
+                if os.path.isdir(config.cache_path) else []
+
+    def test_deterministic(self):
+        config.use_cache = False
+        first = self.apply()
+        self.assertEquals(self.apply(), first)
+        self.assertIn('Content-Type: text/x-shellscript', first)
+        self.assertIn('Content-Type: text/cloud-config', first)
+
+        # From the cache, and for changed parts
+        config.use_cache = True
+        self.assertEquals(self.apply(), first)
+        self.assertEquals(self.apply(), first)
+        self.assertEquals(len(self.cached()), 1)
+        self.assertNotEqual(self.apply(**{ 'user-data': [ _script ] }),
+                first)
+
+    def test_compression(self):
+        size = len(self.apply())
+        self.assertEquals(self.apply(**{ 'user-data-compression': 'gzip',
+                'user-data-compression-threshold': size + 1 }), self.apply())
+
+        compressed = self.apply(**{ 'user-data-compression': 'gzip',
+                'user-data-compression-threshold': size })
+        self.assertTrue(compressed.startswith('\x1f\x8b'))
+        self.assertEquals(compressed, self.apply(**{
+                'user-data-compression': True }))
+        self.assertRaises(Exception, self.apply,
+                **{ 'user-data-compression': 'bzip2' })
+
+    def test_limit(self):
+        large = '#!/bin/sh\n' + 'echo %s\n' % ('x' * config.user_data_limit)
+        self.assertRaises(user_data.UserDataTooLarge, self.apply,
+                **{ 'user-data': [ large ] })
+        # Compressed user-data is measured
+        self.apply(**{ 'user-data': [ large ],
+                'user-data-compression': 'gzip' })
+
+    def test_offload(self):
+        large = '#!/bin/sh\n' + 'echo %s\n' % ('x' * 100)
+        offload = { 'url': 's3://bucket/parts/', 'threshold': 100 }
+        rendered = self.apply(**{ 'user-data': [ large, _script ],
+                'user-data-offload': offload })
+
+        self.assertEquals(len(self.uploads), 1)
+        url, expires = self.uploads[0]
+        self.assertTrue(url.startswith('s3://bucket/parts/'))
+        self.assertEquals(expires, 3600)
+        self.assertIn('Content-Type: text/x-include-url', rendered)
+        self.assertIn('?Expires=1', rendered)
+        self.assertIn('echo hello', rendered)
+        self.assertNotIn('x' * 100, rendered)
+        # Presigned URLs aren't cached, public ones are
+        self.assertEquals(self.cached(), [])
+
+        offload['expires'] = 0
+        public = self.apply(**{ 'user-data': [ large, _script ],
+                'user-data-offload': offload })
+        self.assertNotIn('Expires', public)
+        self.assertEquals(len(self.cached()), 1)
+
+    def test_offload_uploaded_once(self):
+        large = '#!/bin/sh\n' + 'echo %s\n' % ('x' * 100)
+        offload = { 'url': 's3://bucket/parts', 'threshold': 100 }
+        with plugin.batch():
+            for _ in range(3):
+                self.apply(**{ 'user-data': [ large ],
+                        'user-data-offload': dict(offload) })
+        self.assertEquals(len(self.uploads), 1)
+
+    def test_offload_deferred(self):
+        large = '#!/bin/sh\n' + 'echo %s\n' % ('x' * 100)
+        offload = { 'url': 's3://bucket/parts', 'threshold': 100 }
+        for deferred in [ { 'auto-scaling-group': {} },
+                { 'spot-price': 0.1 } ]:
+            deferred.update({ 'user-data': [ large ],
+                    'user-data-offload': dict(offload) })
+            self.assertRaises(Exception, self.apply, **deferred)
+
+            deferred['user-data-offload']['expires'] = 0
+            self.apply(**deferred)
+        self.assertEquals(self.uploads, [ (self.uploads[0][0], 0) ] * 2)
+
+        self.assertRaises(Exception, self.apply, **{ 'user-data': [ large ],
+                'user-data-offload': { 'url': 's3://bucket/parts',
+                    'expires': -1 } })
+
+if __name__ == '__main__':
+    unittest.main()
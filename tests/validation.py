@@ -1,13 +1,28 @@
-import hc2000.validation
+import hc2002.validation
 import unittest
 
+from hc2002.validation import ValidationError
+
 class ValidateTestCase(unittest.TestCase):
+    def is_valid(self, validator, data):
+        try:
+            hc2002.validation.validate(validator, data)
+            return True
+        except ValidationError:
+            return False
+
+    def errors(self, validator, data, initial_scope=None):
+        try:
+            hc2002.validation.validate(validator, data, initial_scope)
+        except ValidationError as err:
+            return sorted(line for line in str(err).split('\n') if line)
+        self.fail('Expected validate(%s, %s) to fail' % (validator, data))
+
     def validate_test(self, data):
         for validator, data, result in data:
-            self.assertEquals(
-                bool(hc2000.validation.validate(validator, data)),
-                result, 'Test failed: expected %s from validate(%s, %s)'
-                    % (result, validator, data))
+            self.assertEquals(self.is_valid(validator, data), result,
+                    'Test failed: expected %s from validate(%s, %s)'
+                        % (result, validator, data))
 
     def test_is_(self):
         data = [
@@ -50,36 +65,100 @@ class ValidateTestCase(unittest.TestCase):
 
     def test_path(self):
         data = [
-            (hc2000.validation.path, "/etc", True),
-            (hc2000.validation.path, "/etc/", True),
-            (hc2000.validation.path, "/etc/file", True),
-            (hc2000.validation.path, "etc/file", True),
-            (hc2000.validation.path, "file", True),
-
-            (hc2000.validation.path, {}, False),
-            (hc2000.validation.path, [], False),
-            (hc2000.validation.path, 1, False),
+            (hc2002.validation.path, "/etc", True),
+            (hc2002.validation.path, "/etc/", True),
+            (hc2002.validation.path, "/etc/file", True),
+            (hc2002.validation.path, "etc/file", True),
+            (hc2002.validation.path, "file", True),
+
+            (hc2002.validation.path, {}, False),
+            (hc2002.validation.path, [], False),
+            (hc2002.validation.path, 1, False),
         ]
         self.validate_test(data)
 
     def test_absolute_path(self):
         data = [
-            (hc2000.validation.absolute_path, "/etc", True),
-            (hc2000.validation.absolute_path, "/etc/", True),
-            (hc2000.validation.absolute_path, "/etc/file", True),
-            (hc2000.validation.absolute_path, "etc/file", False),
-            (hc2000.validation.absolute_path, "file", False),
+            (hc2002.validation.absolute_path, "/etc", True),
+            (hc2002.validation.absolute_path, "/etc/", True),
+            (hc2002.validation.absolute_path, "/etc/file", True),
+            (hc2002.validation.absolute_path, "etc/file", False),
+            (hc2002.validation.absolute_path, "file", False),
         ]
         self.validate_test(data)
 
     def test_file_mode(self):
         data = [
-            (hc2000.validation.file_mode, 0755, True),
-            (hc2000.validation.file_mode, 0644, True),
-            (hc2000.validation.file_mode, 0123, True),
-            (hc2000.validation.file_mode, 01000, False),
+            (hc2002.validation.file_mode, 0755, True),
+            (hc2002.validation.file_mode, 0644, True),
+            (hc2002.validation.file_mode, 0123, True),
+            (hc2002.validation.file_mode, 01000, False),
         ]
         self.validate_test(data)
 
+    def test_compile(self):
+        check = hc2002.validation.compile({ "a": int })
+        self.assertIs(hc2002.validation.compile(check), check)
+        self.assertIsNone(check({ "a": 1 }))
+        self.assertTrue(check({ "a": "" }))
+        self.assertTrue(self.is_valid(check, { "a": 1 }))
+
+    def test_scope(self):
+        validator = { "a": { "b": [ hc2002.validation.one_or_more(int) ] } }
+        self.assertEquals(self.errors(validator, { "a": { "b": [ 1, "x" ] } }),
+                [ ".a.b[1]: Expected element of type int, got x" ])
+        self.assertEquals(self.errors(validator, { "a": { "b": "x" } },
+                    "top"),
+                [ "top.a.b: Expected element of type int, got x" ])
+        self.assertEquals(self.errors(validator, { "a": { "c": 1 } }),
+                [ ".a: Key error. Expected value in ['b'], got c" ])
+
+    def test_one_of(self):
+        validator = hc2002.validation.one_of(int, basestring)
+        self.validate_test([
+            (validator, 1, True),
+            (validator, "", True),
+            (validator, [], False),
+        ])
+        # Errors from all alternatives are reported together
+        self.assertEquals(self.errors(validator, []), [
+            ": Expected element of type basestring, got []",
+            ": Expected element of type int, got []",
+        ])
+
+    def test_in_(self):
+        validator = hc2002.validation.in_("allow", "deny")
+        self.validate_test([
+            (validator, "allow", True),
+            (validator, "deny", True),
+            (validator, "other", False),
+            (validator, [], False),
+        ])
+        self.assertEquals(self.errors(validator, "other"),
+                [ ": Expected value in ('allow', 'deny'), got other" ])
+
+    def test_at_most_one_of(self):
+        validator = hc2002.validation.at_most_one_of("a", "b")
+        self.validate_test([
+            (validator, {}, True),
+            (validator, { "a": 1 }, True),
+            (validator, { "a": 1, "b": 2 }, False),
+        ])
+        self.assertEquals(self.errors(validator, { "a": 1, "b": 2 }),
+                [ ": Expected at most one of ('a', 'b'), got "
+                    "{'a': 1, 'b': 2}" ])
+
+    def test_context_function(self):
+        def positive(data, context):
+            if data <= 0:
+                context.error('positive number', data)
+
+        self.validate_test([
+            ({ "a": positive }, { "a": 1 }, True),
+            ({ "a": positive }, { "a": 0 }, False),
+        ])
+        self.assertEquals(self.errors({ "a": positive }, { "a": 0 }),
+                [ ".a: Expected positive number, got 0" ])
+
 if __name__ == '__main__':
     unittest.main()